@@ -1,12 +1,16 @@
 """Telegram бот для работы с календарем"""
-import os
+import io
+import asyncio
 import logging
+import secrets
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiofiles import os as aiofiles_os
-import aiofiles
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from cachetools import LRUCache, TTLCache
+from weakref import WeakValueDictionary
 
 from config import Config
 from transcription import TranscriptionService
@@ -16,12 +20,12 @@ from database import (
     init_db, 
     get_user_credentials, 
     save_user_credentials as db_save_user_credentials,
-    create_calendar_event,
+    create_calendar_events_bulk,
     get_calendar_event_by_id
 )
 from datetime import datetime, timedelta
 import re
-import pytz
+from zoneinfo import ZoneInfo
 
 # Настройка логирования
 logging.basicConfig(
@@ -29,54 +33,120 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# aiogram пишет INFO-строку на каждое обработанное обновление
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+# Часовой пояс пользователя (не меняется во время работы)
+TZ = ZoneInfo(Config.TIMEZONE)
 
 # Инициализация бота и диспетчера
 bot = Bot(token=Config.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher(storage=MemoryStorage())
+# Типы обновлений, которые обрабатывает бот (остальные Telegram не будет присылать)
+ALLOWED_UPDATES = ["message"]
 
 # Инициализация сервисов (ленивая инициализация для календаря)
 transcription_service = TranscriptionService()
 nlu_service = NLUService()
-# Словарь для хранения сервисов календаря для каждого пользователя
-user_calendar_services = {}
+
+
+class _CalendarServiceCache(LRUCache):
+    """LRU-кэш сервисов календаря, закрывающий CalDAV-соединение при вытеснении"""
+    
+    def popitem(self):
+        telegram_user_id, service = super().popitem()
+        service.close()
+        return telegram_user_id, service
+
+
+# Кэш сервисов календаря для пользователей (ограничен, чтобы не держать соединения всех пользователей)
+user_calendar_services = _CalendarServiceCache(maxsize=512)
+# Блокировки создания сервиса для каждого пользователя (удаляются, когда не используются)
+_user_calendar_locks: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
+# Готовые ответы на /list: повторные вызовы не ходят в CalDAV
+_list_replies_cache = TTLCache(maxsize=1024, ttl=60)
+# Распознанный текст голосовых сообщений по file_unique_id (одинаков у пересланных копий)
+_transcriptions_cache = LRUCache(maxsize=512)
 
 async def get_user_calendar_service(telegram_user_id: int) -> YandexCalendarService:
     """Получение сервиса календаря для конкретного пользователя"""
-    if telegram_user_id not in user_calendar_services:
+    service = user_calendar_services.get(telegram_user_id)
+    if service is not None:
+        return service
+    
+    lock = _user_calendar_locks.get(telegram_user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _user_calendar_locks[telegram_user_id] = lock
+    
+    async with lock:
+        # Пока ждали блокировку, сервис мог создать другой запрос
+        service = user_calendar_services.get(telegram_user_id)
+        if service is not None:
+            return service
+        
         # Пытаемся получить учетные данные из БД
         credentials = await get_user_credentials(telegram_user_id)
             
+        # Подключение к CalDAV блокирующее, поэтому выполняется в отдельном потоке
         if credentials:
             # Создаем сервис с учетными данными пользователя
-            user_calendar_services[telegram_user_id] = YandexCalendarService(
+            service = await asyncio.to_thread(
+                YandexCalendarService,
                 yandex_user=credentials['yandex_user'],
                 yandex_password=credentials['yandex_password']
             )
         else:
             # Используем глобальные учетные данные из Config (для обратной совместимости)
             if Config.YANDEX_USER and Config.YANDEX_PASS:
-                user_calendar_services[telegram_user_id] = YandexCalendarService()
+                service = await asyncio.to_thread(YandexCalendarService)
             else:
                 raise ValueError("Учетные данные не настроены. Используйте команду /setup для настройки.")
-    
-    return user_calendar_services[telegram_user_id]
+        
+        user_calendar_services[telegram_user_id] = service
+        return service
 
 async def save_user_credentials(telegram_user_id: int, yandex_user: str, yandex_password: str):
     """Сохранение учетных данных пользователя"""
     await db_save_user_credentials(telegram_user_id, yandex_user, yandex_password)
+    _list_replies_cache.pop(telegram_user_id, None)
     
     # Обновляем сервис календаря для пользователя
-    if telegram_user_id in user_calendar_services:
-        user_calendar_services[telegram_user_id].reconnect(yandex_user, yandex_password)
+    service = user_calendar_services.get(telegram_user_id)
+    if service is not None:
+        await asyncio.to_thread(service.reconnect, yandex_user, yandex_password)
     else:
-        user_calendar_services[telegram_user_id] = YandexCalendarService(
+        user_calendar_services[telegram_user_id] = await asyncio.to_thread(
+            YandexCalendarService,
             yandex_user=yandex_user,
-            yandex_password=yandex_password
+            yandex_password=yandex_password,
+            use_cached_url=False
         )
 
-# Создаем папку для временных файлов
-TEMP_DIR = "temp"
-os.makedirs(TEMP_DIR, exist_ok=True)
+
+# Формат даты и времени события в ответах бота
+EVENT_TIME_FORMAT = "%d.%m.%Y в %H:%M"
+# Формат даты и времени события в списке /list
+LIST_TIME_FORMAT = "%d.%m.%Y %H:%M"
+
+# Шаблоны ответов при сохранении учетных данных
+CREDENTIALS_SAVED_TEMPLATE = (
+    "✅ Учетные данные успешно сохранены!\n\n"
+    "📧 Email: {email}\n"
+    "🔑 Пароль: {mask}\n\n"
+    "Теперь ты можешь использовать бота для создания событий в календаре!"
+)
+PASSWORD_UPDATED_TEMPLATE = (
+    "✅ Пароль успешно обновлен!\n\n"
+    "📧 Email: {email}\n"
+    "🔑 Пароль: {mask}\n\n"
+    "Теперь ты можешь использовать бота для создания событий в календаре!"
+)
+
+
+def _format_credentials_reply(template: str, email: str, password: str) -> str:
+    """Подстановка email и замаскированного пароля в шаблон ответа"""
+    return template.format_map({"email": email, "mask": "*" * len(password)})
 
 
 @dp.message(Command("start"))
@@ -168,38 +238,40 @@ async def cmd_list(message: Message):
             )
             return
         
+        cached_reply = _list_replies_cache.get(message.from_user.id)
+        if cached_reply is not None:
+            await message.answer(cached_reply)
+            return
+        
         # Получаем события на ближайшие 7 дней
-        timezone = pytz.timezone(Config.TIMEZONE)
-        start_date = datetime.now(timezone)
+        start_date = datetime.now(TZ)
         end_date = start_date + timedelta(days=7)
         
-        events = cal_service.get_events(start_date, end_date)
+        # CalDAV-клиент синхронный, поэтому выполняем запрос в отдельном потоке.
+        # При ошибке get_events бросает исключение, и ответ не попадает в кэш
+        events = await asyncio.to_thread(cal_service.get_events, start_date, end_date, 10)  # Показываем максимум 10
         
         if not events:
-            await message.answer("📅 У тебя нет событий на ближайшие 7 дней.")
+            reply = "📅 У тебя нет событий на ближайшие 7 дней."
+            _list_replies_cache[message.from_user.id] = reply
+            await message.answer(reply)
             return
         
-        text = "📅 Ближайшие события:\n\n"
-        for i, event in enumerate(events[:10], 1):  # Показываем максимум 10
-            try:
-                event_data = event.icalendar_component
-                summary = str(event_data.get('summary', 'Без названия'))
-                dtstart = event_data.get('dtstart')
-                if dtstart:
-                    dt = dtstart.dt
-                    if hasattr(dt, 'strftime'):
-                        time_str = dt.strftime("%d.%m.%Y %H:%M")
-                    else:
-                        time_str = str(dt)
-                else:
-                    time_str = "Время не указано"
-                
-                text += f"{i}. {summary}\n   📅 {time_str}\n\n"
-            except Exception as e:
-                logger.error(f"Ошибка обработки события: {e}", exc_info=True)
-                continue
+        parts = ["📅 Ближайшие события:\n\n"]
+        for i, event in enumerate(events, 1):
+            dt = event["dtstart"]
+            if dt is None:
+                time_str = "Время не указано"
+            elif hasattr(dt, 'strftime'):
+                time_str = dt.strftime(LIST_TIME_FORMAT)
+            else:
+                time_str = str(dt)
+            
+            parts.append(f"{i}. {event['summary']}\n   📅 {time_str}\n\n")
         
-        await message.answer(text)
+        reply = "".join(parts)
+        _list_replies_cache[message.from_user.id] = reply
+        await message.answer(reply)
         
     except Exception as e:
         logger.error(f"Ошибка получения списка событий: {e}", exc_info=True)
@@ -209,71 +281,80 @@ async def cmd_list(message: Message):
 @dp.message(F.voice)
 async def handle_voice(message: Message):
     """Обработчик голосовых сообщений"""
-    await message.answer("🎤 Обрабатываю голосовое сообщение...")
+    # Одно статусное сообщение, которое редактируется по ходу обработки
+    status_message = await message.answer("🎤 Обрабатываю голосовое сообщение...")
     
     try:
-        # Скачиваем голосовое сообщение
-        voice_file = await bot.get_file(message.voice.file_id)
-        file_path = os.path.join(TEMP_DIR, f"{message.voice.file_id}.ogg")
-        
-        await bot.download_file(voice_file.file_path, file_path)
-        logger.info(f"Голосовое сообщение скачано: {file_path}")
-        
-        # Проверяем размер файла для информативного сообщения
-        file_size = os.path.getsize(file_path)
-        max_size = 1024 * 1024  # 1 МБ
-        
-        if file_size > max_size:
-            size_mb = file_size / (1024 * 1024)
-            await message.answer(
-                f"🔤 Распознаю речь...\n"
-                f"📊 Файл большой ({size_mb:.2f} МБ), разделяю на части для обработки."
+        # Не скачиваем файл, который все равно не примет сервис распознавания
+        if message.voice.file_size and message.voice.file_size > transcription_service.max_size:
+            await status_message.edit_text(
+                "❌ Аудиофайл слишком большой для обработки.\n\n"
+                "💡 Совет: Запишите более короткое голосовое сообщение."
             )
-        else:
-            await message.answer("🔤 Распознаю речь...")
+            return
         
-        try:
-            text = await transcription_service.transcribe_voice(file_path)
-        except Exception as transcribe_error:
-            error_msg = str(transcribe_error)
-            logger.error(f"Ошибка транскрибации: {error_msg}")
-            # Проверяем, связана ли ошибка с размером файла
-            if "слишком большой" in error_msg.lower() or "большой файл" in error_msg.lower():
-                await message.answer(
-                    "❌ Аудиофайл слишком большой для обработки.\n\n"
-                    "💡 Совет: Запишите более короткое голосовое сообщение (до 1 МБ)."
-                )
-            elif "распознавания речи" in error_msg.lower() or "speechkit" in error_msg.lower():
-                await message.answer(
-                    "❌ Не удалось распознать речь.\n\n"
-                    "Попробуйте записать сообщение еще раз, убедившись, что:\n"
-                    "• Микрофон работает корректно\n"
-                    "• Речь четкая и разборчивая\n"
-                    "• Сообщение не слишком длинное"
-                )
-            else:
-                await message.answer(
-                    "❌ Произошла ошибка при обработке голосового сообщения.\n\n"
-                    "Попробуйте записать сообщение еще раз."
+        # Подключаемся к календарю параллельно со скачиванием, распознаванием и NLU
+        cal_service_task = asyncio.create_task(get_user_calendar_service(message.from_user.id))
+        # Ошибку подключения разбираем ниже; если обработка прервется раньше, она не попадет в лог
+        cal_service_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        
+        # Пересланное или повторно отправленное голосовое сообщение уже распознано
+        text = _transcriptions_cache.get(message.voice.file_unique_id)
+        if text is None:
+            # Скачиваем голосовое сообщение сразу в память, без временного файла
+            audio_buffer = io.BytesIO()
+            await bot.download(message.voice, destination=audio_buffer)
+            audio_data = audio_buffer.getvalue()
+            logger.info("Голосовое сообщение скачано: %s", message.voice.file_id)
+            
+            try:
+                text = await transcription_service.transcribe_voice_bytes(
+                    audio_data,
+                    filename=f"{message.voice.file_id}.ogg"
                 )
-            return
+            except Exception as transcribe_error:
+                error_msg = str(transcribe_error)
+                logger.error(f"Ошибка транскрибации: {error_msg}")
+                # Проверяем, связана ли ошибка с размером файла
+                if "слишком большой" in error_msg.lower() or "большой файл" in error_msg.lower():
+                    await status_message.edit_text(
+                        "❌ Аудиофайл слишком большой для обработки.\n\n"
+                        "💡 Совет: Запишите более короткое голосовое сообщение."
+                    )
+                elif "распознавания речи" in error_msg.lower() or "speechkit" in error_msg.lower():
+                    await status_message.edit_text(
+                        "❌ Не удалось распознать речь.\n\n"
+                        "Попробуйте записать сообщение еще раз, убедившись, что:\n"
+                        "• Микрофон работает корректно\n"
+                        "• Речь четкая и разборчивая\n"
+                        "• Сообщение не слишком длинное"
+                    )
+                else:
+                    await status_message.edit_text(
+                        "❌ Произошла ошибка при обработке голосового сообщения.\n\n"
+                        "Попробуйте записать сообщение еще раз."
+                    )
+                return
+            
+            _transcriptions_cache[message.voice.file_unique_id] = text
+        else:
+            logger.info("Распознанный текст взят из кэша: %s", message.voice.file_unique_id)
         
         if not text or len(text.strip()) == 0:
-            await message.answer("❌ Не удалось распознать речь. Попробуйте записать сообщение еще раз.")
+            await status_message.edit_text("❌ Не удалось распознать речь. Попробуйте записать сообщение еще раз.")
             return
         
-        await message.answer(f"📝 Распознанный текст: \"{text}\"")
+        await status_message.edit_text(f"📝 Распознанный текст: \"{text}\"\n\n🤖 Анализирую запрос...")
         
-        # Обрабатываем текст через NLU
-        await message.answer("🤖 Анализирую запрос...")
-        events_info = await nlu_service.extract_event_info(text)
+        # Обрабатываем текст через NLU (пользователь ждет ответа - опрашиваем модели параллельно)
+        events_info = await nlu_service.extract_event_info(text, fast=True)
         
         # Проверяем наличие учетных данных перед созданием событий
         try:
-            cal_service = await get_user_calendar_service(message.from_user.id)
+            cal_service = await cal_service_task
         except ValueError as e:
             logger.error(f"Ошибка получения сервиса календаря: {e}")
-            await message.answer(
+            await status_message.edit_text(
                 "❌ Учетные данные не настроены.\n\n"
                 "Используй команду /setup для настройки учетных данных Яндекс Календаря."
             )
@@ -283,49 +364,64 @@ async def handle_voice(message: Message):
         created_events = []
         errors = []
         
-        for idx, event_info in enumerate(events_info):
+        to_create = []
+        for event_info in events_info:
             if event_info["action"] == "create_event":
-                try:
-                    await message.answer(f"📅 Создаю событие {idx + 1} из {len(events_info)}...")
-                    
-                    event_data = cal_service.create_event(
-                        summary=event_info["summary"],
-                        start_datetime=event_info["start_datetime"],
-                        duration_minutes=event_info.get("duration_minutes", 60),
-                        description=event_info.get("description")
-                    )
-                    
-                    # Сохраняем событие в базу данных
-                    db_event_id = await create_calendar_event(
-                        event_id=event_data["event_id"],
-                        summary=event_data["summary"],
-                        start_datetime=event_data["start"],
-                        end_datetime=event_data["end"],
-                        telegram_user_id=message.from_user.id,
-                        description=event_info.get("description")
-                    )
-                    
-                    # Создаем уведомления
-                    from scheduler import create_notifications
-                    await create_notifications(db_event_id, event_data["start"])
-                    
-                    created_events.append({
-                        "summary": event_data["summary"],
-                        "start": event_data["start"],
-                        "duration": event_info.get("duration_minutes", 60)
-                    })
-                except Exception as e:
-                    logger.error(f"Ошибка создания события {idx + 1}: {e}", exc_info=True)
-                    errors.append(f"Событие '{event_info.get('summary', 'Без названия')}': не удалось создать")
+                to_create.append(event_info)
             else:
                 errors.append(f"Действие '{event_info['action']}' пока не поддерживается.")
         
-        # Формируем ответ пользователю
+        # Создаем события в календаре параллельно
+        results = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    cal_service.create_event,
+                    summary=event_info["summary"],
+                    start_datetime=event_info["start_datetime"],
+                    duration_minutes=event_info.get("duration_minutes", 60),
+                    description=event_info.get("description")
+                )
+                for event_info in to_create
+            ),
+            return_exceptions=True
+        )
+        
+        for idx, (event_info, event_data) in enumerate(zip(to_create, results)):
+            if isinstance(event_data, Exception):
+                logger.error(f"Ошибка создания события {idx + 1}: {event_data}", exc_info=event_data)
+                errors.append(f"Событие '{event_info.get('summary', 'Без названия')}': не удалось создать")
+                continue
+            
+            created_events.append({
+                "event_id": event_data["event_id"],
+                "summary": event_data["summary"],
+                "description": event_info.get("description"),
+                "start": event_data["start"],
+                "end": event_data["end"],
+                "duration": event_info.get("duration_minutes", 60)
+            })
+        
+        # Сохраняем все созданные события в базу данных одной транзакцией
+        if created_events:
+            # Список событий пользователя изменился
+            _list_replies_cache.pop(message.from_user.id, None)
+            try:
+                # События и их уведомления сохраняются одной транзакцией
+                from scheduler import get_notification_times
+                for event in created_events:
+                    event["notification_times"] = get_notification_times(event["start"])
+                await create_calendar_events_bulk(created_events, message.from_user.id)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения событий в базу данных: {e}", exc_info=True)
+                errors.append("Не удалось настроить напоминания для созданных событий")
+        
+        # Формируем ответ пользователю (итог заменяет статусное сообщение)
+        parts = [f"📝 Распознанный текст: \"{text}\"\n\n"]
         if created_events:
             if len(created_events) == 1:
                 event = created_events[0]
-                start_str = event["start"].strftime("%d.%m.%Y в %H:%M")
-                await message.answer(
+                start_str = event["start"].strftime(EVENT_TIME_FORMAT)
+                parts.append(
                     f"✅ Событие успешно создано!\n\n"
                     f"📌 {event['summary']}\n"
                     f"📅 {start_str}\n"
@@ -333,39 +429,61 @@ async def handle_voice(message: Message):
                     f"Я напомню тебе за 60 и 15 минут до начала."
                 )
             else:
-                response_text = f"✅ Создано событий: {len(created_events)}\n\n"
+                parts.append(f"✅ Создано событий: {len(created_events)}\n\n")
                 for i, event in enumerate(created_events, 1):
-                    start_str = event["start"].strftime("%d.%m.%Y в %H:%M")
-                    response_text += f"{i}. 📌 {event['summary']}\n   📅 {start_str}\n   ⏱ {event['duration']} минут\n\n"
-                response_text += "Я напомню тебе за 60 и 15 минут до начала каждого события."
-                await message.answer(response_text)
+                    start_str = event["start"].strftime(EVENT_TIME_FORMAT)
+                    parts.append(f"{i}. 📌 {event['summary']}\n   📅 {start_str}\n   ⏱ {event['duration']} минут\n\n")
+                parts.append("Я напомню тебе за 60 и 15 минут до начала каждого события.")
         
         if errors:
-            error_text = "❌ Ошибки при создании событий:\n\n" + "\n".join(f"• {err}" for err in errors)
-            await message.answer(error_text)
+            if created_events:
+                parts.append("\n\n")
+            parts.append("❌ Ошибки при создании событий:\n\n")
+            parts.append("\n".join(f"• {err}" for err in errors))
         
-        # Удаляем временный файл
-        try:
-            await aiofiles_os.remove(file_path)
-        except:
-            pass
+        if created_events or errors:
+            await status_message.edit_text("".join(parts))
             
     except Exception as e:
         logger.error(f"Ошибка обработки голосового сообщения: {e}", exc_info=True)
-        
-        # Удаляем временный файл в случае ошибки
-        try:
-            file_path = os.path.join(TEMP_DIR, f"{message.voice.file_id}.ogg")
-            await aiofiles_os.remove(file_path)
-        except:
-            pass
-        
         await message.answer(
             "❌ Произошла ошибка при обработке голосового сообщения.\n\n"
             "Попробуйте записать сообщение еще раз или используйте /help для справки."
         )
 
 
+# Паттерн для email
+_EMAIL_RE = re.compile(r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})', re.IGNORECASE)
+# Паттерны для пароля (после ключевых слов или просто длинная строка)
+_PASSWORD_RES = [
+    re.compile(r'(?:пароль|password|pass|пароль приложения)[:\s]+([^\s\n]+)', re.IGNORECASE),
+    re.compile(r'(?:🔑|ключ)[:\s]+([^\s\n]+)', re.IGNORECASE),
+    re.compile(r'пароль[:\s]*([a-zA-Z0-9\-_]{10,})', re.IGNORECASE),  # Пароль приложения обычно длинный
+]
+# Пароль приложения обычно содержит буквы, цифры, дефисы и подчеркивания
+_PW_SHAPE_RE = re.compile(r'^[a-zA-Z0-9\-_]{10,}$')
+
+
+# Ключевые слова, рядом с которыми пользователь обычно указывает пароль
+_CREDENTIAL_KEYWORDS = ("пароль", "pass", "ключ", "🔑")
+
+
+def may_contain_credentials(text: str) -> bool:
+    """
+    Быстрая проверка, может ли текст содержать учетные данные
+    
+    Отсекает обычные сообщения без запуска регулярных выражений:
+    email содержит "@", пароль указывается после ключевого слова
+    или отправляется отдельной строкой из латиницы и цифр.
+    """
+    if "@" in text:
+        return True
+    lowered = text.lower()
+    if any(keyword in lowered for keyword in _CREDENTIAL_KEYWORDS):
+        return True
+    return len(text) >= 10 and text.isascii()
+
+
 def extract_credentials_from_text(text: str) -> tuple:
     """
     Извлечение email и пароля из текста
@@ -375,26 +493,17 @@ def extract_credentials_from_text(text: str) -> tuple:
     """
     text = text.strip()
     
-    # Паттерн для email
-    email_pattern = r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
-    # Паттерн для пароля (после ключевых слов или просто длинная строка)
-    password_patterns = [
-        r'(?:пароль|password|pass|пароль приложения)[:\s]+([^\s\n]+)',
-        r'(?:🔑|ключ)[:\s]+([^\s\n]+)',
-        r'пароль[:\s]*([a-zA-Z0-9\-_]{10,})',  # Пароль приложения обычно длинный
-    ]
-    
     email = None
     password = None
     
     # Ищем email
-    email_match = re.search(email_pattern, text, re.IGNORECASE)
+    email_match = _EMAIL_RE.search(text)
     if email_match:
         email = email_match.group(1).lower()
     
     # Ищем пароль
-    for pattern in password_patterns:
-        password_match = re.search(pattern, text, re.IGNORECASE)
+    for pattern in _PASSWORD_RES:
+        password_match = pattern.search(text)
         if password_match:
             password = password_match.group(1).strip()
             # Убираем возможные символы форматирования
@@ -414,14 +523,13 @@ def extract_credentials_from_text(text: str) -> tuple:
             
             for part in parts:
                 part = part.strip().strip(':').strip('-').strip()
-                # Пароль приложения обычно содержит буквы, цифры, дефисы и подчеркивания
-                if re.match(r'^[a-zA-Z0-9\-_]{10,}$', part):
+                if _PW_SHAPE_RE.match(part):
                     password = part
                     break
         else:
             # Если нет email, проверяем, не является ли весь текст паролем
             # Пароль приложения обычно длинный (10+ символов) и содержит буквы и цифры
-            if re.match(r'^[a-zA-Z0-9\-_]{10,}$', text) and len(text) >= 10:
+            if _PW_SHAPE_RE.match(text):
                 password = text
     
     return email, password
@@ -433,8 +541,11 @@ async def handle_text(message: Message):
     text = message.text.strip()
     user_id = message.from_user.id
     
-    # Пытаемся извлечь учетные данные из текста
-    email, password = extract_credentials_from_text(text)
+    # Пытаемся извлечь учетные данные из текста (только если они там в принципе могут быть)
+    if may_contain_credentials(text):
+        email, password = extract_credentials_from_text(text)
+    else:
+        email, password = None, None
     
     # Если найден пароль или email, обрабатываем как настройку учетных данных
     if password or email:
@@ -455,12 +566,7 @@ async def handle_text(message: Message):
                     await save_user_credentials(user_id, email, password)
                     # Очищаем состояние настройки
                     user_setup_state.pop(user_id, None)
-                    await message.answer(
-                        f"✅ Учетные данные успешно сохранены!\n\n"
-                        f"📧 Email: {email}\n"
-                        f"🔑 Пароль: {'*' * len(password)}\n\n"
-                        "Теперь ты можешь использовать бота для создания событий в календаре!"
-                    )
+                    await message.answer(_format_credentials_reply(CREDENTIALS_SAVED_TEMPLATE, email, password))
                     return
             else:
                 # Есть только пароль, проверяем сохраненный email
@@ -468,12 +574,7 @@ async def handle_text(message: Message):
                     email = user_setup_state[user_id]['email']
                     await save_user_credentials(user_id, email, password)
                     user_setup_state.pop(user_id, None)
-                    await message.answer(
-                        f"✅ Учетные данные успешно сохранены!\n\n"
-                        f"📧 Email: {email}\n"
-                        f"🔑 Пароль: {'*' * len(password)}\n\n"
-                        "Теперь ты можешь использовать бота для создания событий в календаре!"
-                    )
+                    await message.answer(_format_credentials_reply(CREDENTIALS_SAVED_TEMPLATE, email, password))
                     return
                 else:
                     # Проверяем, есть ли уже сохраненные учетные данные
@@ -483,10 +584,7 @@ async def handle_text(message: Message):
                         # Обновляем только пароль
                         await save_user_credentials(user_id, credentials['yandex_user'], password)
                         await message.answer(
-                            f"✅ Пароль успешно обновлен!\n\n"
-                            f"📧 Email: {credentials['yandex_user']}\n"
-                            f"🔑 Пароль: {'*' * len(password)}\n\n"
-                            "Теперь ты можешь использовать бота для создания событий в календаре!"
+                            _format_credentials_reply(PASSWORD_UPDATED_TEMPLATE, credentials['yandex_user'], password)
                         )
                         return
                     else:
@@ -537,14 +635,9 @@ async def main():
         logger.error(f"Ошибка инициализации базы данных: {e}")
         return
     
-    # Проверяем подключение к календарю (если есть глобальные учетные данные)
+    # Подключение к календарю выполняется лениво при первом обращении пользователя
     if Config.YANDEX_USER and Config.YANDEX_PASS:
-        try:
-            test_service = YandexCalendarService()
-            logger.info("Подключение к Яндекс Календарю успешно (глобальные учетные данные)")
-        except Exception as e:
-            logger.warning(f"Не удалось подключиться к Яндекс Календарю с глобальными учетными данными: {e}")
-            logger.info("Пользователи смогут настроить свои учетные данные через команду /setup")
+        logger.info("Глобальные учетные данные Яндекс настроены")
     else:
         logger.info("Глобальные учетные данные Яндекс не настроены. Пользователи смогут настроить их через команду /setup")
     
@@ -560,12 +653,52 @@ async def main():
     # Запускаем бота
     logger.info("Бот запущен и готов к работе")
     try:
-        await dp.start_polling(bot)
+        if Config.WEBHOOK_URL:
+            await run_webhook()
+        else:
+            # Telegram не отдает обновления через getUpdates, пока установлен webhook
+            # (например, после прошлого запуска с WEBHOOK_URL)
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
     except Exception as e:
         logger.error(f"Критическая ошибка бота: {e}")
         raise
+    finally:
+        await transcription_service.close()
+
+
+async def run_webhook():
+    """Запуск бота в режиме webhook (Telegram сам присылает обновления)"""
+    # Случайный путь, чтобы endpoint нельзя было угадать
+    webhook_path = f"/webhook/{secrets.token_hex(16)}"
+    
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=Config.WEBHOOK_SECRET
+    ).register(app, path=webhook_path)
+    setup_application(app, dp, bot=bot)
+    
+    await bot.set_webhook(
+        url=Config.WEBHOOK_URL.rstrip("/") + webhook_path,
+        secret_token=Config.WEBHOOK_SECRET,
+        drop_pending_updates=True,
+        allowed_updates=ALLOWED_UPDATES
+    )
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=Config.WEB_SERVER_HOST, port=Config.WEB_SERVER_PORT)
+    await site.start()
+    logger.info(f"Webhook сервер запущен на {Config.WEB_SERVER_HOST}:{Config.WEB_SERVER_PORT}")
+    
+    try:
+        # Работаем, пока процесс не остановят
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -1,32 +1,53 @@
 """Сервис для работы с Яндекс Календарем через CalDAV"""
 import caldav
+from caldav.lib.error import AuthorizationError, NotFoundError
+from cachetools import LRUCache
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from config import Config
 import logging
-import pytz
+import threading
+from zoneinfo import ZoneInfo
 
 logger = logging.getLogger(__name__)
 
+# Часовые пояса создаются один раз при импорте
+_LOCAL_TZ = ZoneInfo(Config.TIMEZONE)
+_UTC = ZoneInfo("UTC")
+
+# URL найденного календаря для каждого пользователя: повторное подключение
+# обходится без PROPFIND-запросов к principal и списку календарей.
+# Сервисы работают в потоках (asyncio.to_thread), поэтому доступ - под блокировкой
+_calendar_urls: "LRUCache[str, str]" = LRUCache(maxsize=1024)
+_calendar_urls_lock = threading.Lock()
+
 class YandexCalendarService:
     """Сервис для работы с Яндекс Календарем"""
     
-    def __init__(self, yandex_user: Optional[str] = None, yandex_password: Optional[str] = None):
+    def __init__(
+        self,
+        yandex_user: Optional[str] = None,
+        yandex_password: Optional[str] = None,
+        use_cached_url: bool = True
+    ):
         """
         Инициализация сервиса календаря
         
         Args:
             yandex_user: Email пользователя Яндекс (если None, используется из Config)
             yandex_password: Пароль приложения Яндекс (если None, используется из Config)
+            use_cached_url: Использовать сохраненный URL календаря (False - для новых учетных
+                данных: поиск календаря заодно проверяет логин и пароль на сервере)
         """
         self.yandex_user = yandex_user or Config.YANDEX_USER
         self.yandex_password = yandex_password or Config.YANDEX_PASS
         self.client: Optional[caldav.DAVClient] = None
         self.calendar: Optional[caldav.Calendar] = None
         if self.yandex_user and self.yandex_password:
-            self._connect()
+            self._connect(use_cached_url)
     
-    def _connect(self):
+    def _connect(self, use_cached_url: bool = True):
         """Подключение к Яндекс Календарю"""
         try:
             if not self.yandex_user or not self.yandex_password:
@@ -39,17 +60,26 @@ class YandexCalendarService:
                 username=self.yandex_user,
                 password=self.yandex_password
             )
+            # Держим keep-alive соединения к CalDAV серверу между запросами
+            self.client.session.mount("https://", HTTPAdapter(pool_maxsize=32, pool_block=False))
             
-            # Получаем главный календарь
-            principal = self.client.principal()
-            calendars = principal.calendars()
-            
-            if not calendars:
-                raise ValueError("Календари не найдены в Яндекс аккаунте")
-            
-            # Берем первый календарь (обычно основной)
-            self.calendar = calendars[0]
-            logger.info(f"Подключено к календарю: {self.calendar.name}")
+            with _calendar_urls_lock:
+                calendar_url = _calendar_urls.get(self.yandex_user) if use_cached_url else None
+            if calendar_url:
+                self.calendar = self.client.calendar(url=calendar_url)
+            else:
+                # Получаем главный календарь
+                principal = self.client.principal()
+                calendars = principal.calendars()
+                
+                if not calendars:
+                    raise ValueError("Календари не найдены в Яндекс аккаунте")
+                
+                # Берем первый календарь (обычно основной)
+                self.calendar = calendars[0]
+                with _calendar_urls_lock:
+                    _calendar_urls[self.yandex_user] = str(self.calendar.url)
+            logger.info("Подключено к календарю: %s", self.calendar.url)
             
         except Exception as e:
             logger.error(f"Ошибка подключения к Яндекс Календарю: {e}")
@@ -57,11 +87,31 @@ class YandexCalendarService:
     
     def reconnect(self, yandex_user: str, yandex_password: str):
         """Переподключение с новыми учетными данными"""
+        self.close()
         self.yandex_user = yandex_user
         self.yandex_password = yandex_password
+        # Новые учетные данные проверяются запросом к серверу, а не сохраненным URL
+        self._connect(use_cached_url=False)
+    
+    def _forget_calendar_url(self, error: Exception):
+        """
+        Сброс сохраненного URL календаря, если сервер отверг запрос к нему
+        (пароль отозван или календарь удален) - следующее подключение найдет календарь заново
+        """
+        if isinstance(error, (AuthorizationError, NotFoundError)):
+            with _calendar_urls_lock:
+                _calendar_urls.pop(self.yandex_user, None)
+            self.calendar = None
+    
+    def close(self):
+        """Закрытие соединения с CalDAV сервером"""
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception as e:
+                logger.warning(f"Ошибка закрытия соединения с Яндекс Календарем: {e}")
         self.client = None
         self.calendar = None
-        self._connect()
     
     def create_event(
         self,
@@ -89,21 +139,20 @@ class YandexCalendarService:
                 self._connect()
             
             # Обрабатываем часовой пояс для start_datetime
-            timezone = pytz.timezone(Config.TIMEZONE)
             if start_datetime.tzinfo is None:
                 # Если datetime без часового пояса, считаем что это локальное время
-                start_datetime = timezone.localize(start_datetime)
-            elif start_datetime.tzinfo != timezone:
-                # Если часовой пояс другой, конвертируем в локальный
-                start_datetime = start_datetime.astimezone(timezone)
+                start_datetime = start_datetime.replace(tzinfo=_LOCAL_TZ)
+            else:
+                # Иначе конвертируем в локальный часовой пояс
+                start_datetime = start_datetime.astimezone(_LOCAL_TZ)
             
             # Вычисляем конец события
             end_datetime = start_datetime + timedelta(minutes=duration_minutes)
             
             # CalDAV обычно работает с naive datetime (без часового пояса) или UTC
             # Конвертируем в UTC для CalDAV, но сохраняем оригинальные значения для возврата
-            start_datetime_utc = start_datetime.astimezone(pytz.UTC)
-            end_datetime_utc = end_datetime.astimezone(pytz.UTC)
+            start_datetime_utc = start_datetime.astimezone(_UTC)
+            end_datetime_utc = end_datetime.astimezone(_UTC)
             
             # Создаем событие (CalDAV может работать с UTC datetime)
             event = self.calendar.save_event(
@@ -113,7 +162,7 @@ class YandexCalendarService:
                 description=description or "Создано через Telegram Бота"
             )
             
-            logger.info(f"Событие '{summary}' успешно создано в календаре")
+            logger.info("Событие '%s' успешно создано в календаре", summary)
             
             return {
                 "event_id": event.url.split("/")[-1].replace(".ics", ""),
@@ -125,22 +174,28 @@ class YandexCalendarService:
             
         except Exception as e:
             logger.error(f"Ошибка создания события: {e}")
+            self._forget_calendar_url(e)
             raise
     
     def get_events(
         self,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
-    ) -> list:
+        end_date: Optional[datetime] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
         """
         Получение событий из календаря
         
         Args:
             start_date: Начало периода
             end_date: Конец периода
+            limit: Максимальное количество событий (разбираются только они)
             
         Returns:
-            Список событий
+            Список словарей с ключами summary и dtstart (None, если время не указано)
+            
+        Raises:
+            Exception: Ошибка подключения или запроса к CalDAV серверу
         """
         try:
             if not self.calendar:
@@ -148,23 +203,18 @@ class YandexCalendarService:
                     raise ValueError("Учетные данные не настроены. Используйте команду /setup для настройки.")
                 self._connect()
             
-            # Обрабатываем часовые пояса для дат поиска
-            timezone = pytz.timezone(Config.TIMEZONE)
+            # Обрабатываем часовые пояса для дат поиска (naive считаем локальным временем)
             if start_date:
                 if start_date.tzinfo is None:
-                    start_date = timezone.localize(start_date)
-                elif start_date.tzinfo != timezone:
-                    start_date = start_date.astimezone(timezone)
+                    start_date = start_date.replace(tzinfo=_LOCAL_TZ)
                 # Конвертируем в UTC для CalDAV
-                start_date = start_date.astimezone(pytz.UTC)
+                start_date = start_date.astimezone(_UTC)
             
             if end_date:
                 if end_date.tzinfo is None:
-                    end_date = timezone.localize(end_date)
-                elif end_date.tzinfo != timezone:
-                    end_date = end_date.astimezone(timezone)
+                    end_date = end_date.replace(tzinfo=_LOCAL_TZ)
                 # Конвертируем в UTC для CalDAV
-                end_date = end_date.astimezone(pytz.UTC)
+                end_date = end_date.astimezone(_UTC)
             
             if start_date and end_date:
                 events = self.calendar.search(
@@ -174,8 +224,23 @@ class YandexCalendarService:
             else:
                 events = self.calendar.events()
             
-            return list(events)
+            result = []
+            for event in events[:limit]:
+                # Ошибки разбора ICS ожидаемы только для битых данных; нет свойств - берем значения по умолчанию
+                try:
+                    component = event.icalendar_component
+                except ValueError as e:
+                    logger.warning("Не удалось разобрать событие %s: %s", event.url, e)
+                    continue
+                dtstart = component.get("dtstart")
+                result.append({
+                    "summary": str(component.get("summary", "Без названия")),
+                    "dtstart": dtstart.dt if dtstart else None
+                })
+            return result
             
         except Exception as e:
             logger.error(f"Ошибка получения событий: {e}")
-            return []
+            self._forget_calendar_url(e)
+            # Пробрасываем ошибку: пустой список означал бы "нет событий" и попал бы в кэш ответов
+            raise
@@ -1,5 +1,7 @@
 """Конфигурация приложения"""
 import os
+import secrets
+from datetime import timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,11 +12,26 @@ class Config:
     # Telegram
     TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
     
+    # Webhook (если WEBHOOK_URL не указан, бот работает через long polling)
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+    # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (генерируется при старте, если не указан)
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+    WEB_SERVER_PORT = int(os.getenv("PORT", "8080"))
+    
     # OpenAI (для транскрибации голоса через Whisper API)
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    # Максимум одновременных запросов к Whisper API (остальные ждут очереди)
+    OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+    # Максимум запросов к Whisper API в секунду (0 - без ограничения)
+    OPENAI_MAX_RPS = float(os.getenv("OPENAI_MAX_RPS", "0"))
     
     # Google Gemini (для обработки текста и извлечения данных о событиях)
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    # Несколько ключей через запятую: при исчерпании квоты запросы переключаются на следующий ключ
+    GEMINI_API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or (GEMINI_API_KEYS[0] if GEMINI_API_KEYS else None)
+    if GEMINI_API_KEY and GEMINI_API_KEY not in GEMINI_API_KEYS:
+        GEMINI_API_KEYS.insert(0, GEMINI_API_KEY)
     
     # Яндекс Календарь (опционально - можно настроить через бота командой /setup)
     # Эти переменные используются только для обратной совместимости, если пользователь не настроил свои учетные данные
@@ -24,6 +41,8 @@ class Config:
     
     # Уведомления
     NOTIFICATION_TIMES = [int(x) for x in os.getenv("NOTIFICATION_TIMES", "15,60").split(",")]
+    # Те же интервалы в виде timedelta, чтобы не создавать их для каждого события
+    NOTIFICATION_DELTAS = tuple(timedelta(minutes=m) for m in NOTIFICATION_TIMES)
     
     # Часовой пояс
     TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
@@ -32,6 +51,18 @@ class Config:
     DATABASE_URL = os.getenv("DATABASE_URL")
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL не указан. Укажите строку подключения к PostgreSQL.")
+    # Приводим схему к postgresql:// один раз при загрузке (asyncpg не знает SQLAlchemy-префиксов)
+    if DATABASE_URL.startswith("postgresql+asyncpg://"):
+        DATABASE_URL = DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+    elif DATABASE_URL.startswith("postgres://"):
+        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    # Размер пула соединений (min_size соединений открываются сразу при старте)
+    DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "5"))
+    DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+    # Соединение пересоздается после указанного числа запросов
+    DB_POOL_MAX_QUERIES = int(os.getenv("DB_POOL_MAX_QUERIES", "50000"))
+    # Размер кэша подготовленных запросов asyncpg на соединение (0 - для pgbouncer в режиме transaction)
+    DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
     
     @classmethod
     def validate(cls):
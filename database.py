@@ -1,51 +1,121 @@
 """База данных для хранения событий и уведомлений"""
+import asyncio
 import asyncpg
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from config import Config
 import logging
-import pytz
+from zoneinfo import ZoneInfo
 
 logger = logging.getLogger(__name__)
 
 # Глобальный пул соединений
 _pool: Optional[asyncpg.Pool] = None
+# Не дает параллельным первым запросам создать несколько пулов
+_pool_lock = asyncio.Lock()
+
+# Ключ advisory-блокировки PostgreSQL на время создания схемы
+_SCHEMA_LOCK_ID = 720_451_001
+
+# Часовой пояс пользователя (создается один раз при импорте)
+_TZ = ZoneInfo(Config.TIMEZONE)
+_UTC = ZoneInfo("UTC")
+
+# Схема базы данных
+_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS calendar_events (
+        id SERIAL PRIMARY KEY,
+        event_id VARCHAR(255) UNIQUE NOT NULL,
+        summary VARCHAR(255) NOT NULL,
+        description TEXT,
+        start_datetime TIMESTAMP NOT NULL,
+        end_datetime TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        notified_15min BOOLEAN DEFAULT FALSE,
+        notified_60min BOOLEAN DEFAULT FALSE,
+        telegram_user_id INTEGER NOT NULL
+    );
+    
+    CREATE TABLE IF NOT EXISTS notifications (
+        id SERIAL PRIMARY KEY,
+        event_id INTEGER NOT NULL,
+        notification_time TIMESTAMP NOT NULL,
+        sent BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    
+    CREATE TABLE IF NOT EXISTS user_credentials (
+        id SERIAL PRIMARY KEY,
+        telegram_user_id INTEGER UNIQUE NOT NULL,
+        yandex_user VARCHAR(255) NOT NULL,
+        yandex_password VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    
+    -- Индексы для запросов планировщика и выборок событий пользователя.
+    -- Отправленные уведомления не запрашиваются, поэтому индекс частичный
+    CREATE INDEX IF NOT EXISTS idx_notifications_pending
+        ON notifications (notification_time) WHERE sent = FALSE;
+    CREATE INDEX IF NOT EXISTS idx_notifications_event_id
+        ON notifications (event_id);
+    CREATE INDEX IF NOT EXISTS idx_calendar_events_user_start
+        ON calendar_events (telegram_user_id, start_datetime);
+"""
+
+# Кэш учетных данных пользователей (меняются редко, а читаются почти на каждое сообщение)
+_credentials_cache: TTLCache = TTLCache(maxsize=10000, ttl=300)
+# Номер изменения учетных данных: чтение, во время которого данные сохранили,
+# не кладет в кэш устаревшую строку
+_credentials_generation = 0
 
 
 async def get_pool() -> asyncpg.Pool:
     """Получение пула соединений"""
     global _pool
-    if _pool is None:
-        # Парсим DATABASE_URL для получения параметров подключения
-        db_url = Config.DATABASE_URL
-        if not db_url:
-            raise ValueError("DATABASE_URL не указан")
-        
-        # Убираем префиксы для asyncpg
-        if db_url.startswith("postgresql+asyncpg://"):
-            db_url = db_url.replace("postgresql+asyncpg://", "postgresql://", 1)
-        elif db_url.startswith("postgresql://"):
-            pass  # Уже правильный формат
-        else:
-            raise ValueError(f"Неподдерживаемый формат DATABASE_URL: {db_url}")
-        
-        # Парсим URL (urlparse правильно обрабатывает специальные символы в пароле)
-        from urllib.parse import urlparse, unquote
-        parsed = urlparse(db_url)
-        
-        # Декодируем пароль, если он был закодирован
-        password = unquote(parsed.password) if parsed.password else None
-        
-        _pool = await asyncpg.create_pool(
-            host=parsed.hostname,
-            port=parsed.port or 5432,
-            user=unquote(parsed.username) if parsed.username else None,
-            password=password,
-            database=unquote(parsed.path.lstrip('/')) if parsed.path else None,
-            min_size=1,
-            max_size=10
-        )
-    return _pool
+    if _pool is not None:
+        return _pool
+    
+    async with _pool_lock:
+        # Пул мог создать другой запрос, пока ждали блокировку
+        if _pool is None:
+            # Парсим DATABASE_URL для получения параметров подключения
+            # (схема уже нормализована в Config)
+            db_url = Config.DATABASE_URL
+            if not db_url.startswith("postgresql://"):
+                raise ValueError(f"Неподдерживаемый формат DATABASE_URL: {db_url.split('://')[0]}")
+            
+            # Парсим URL (urlparse правильно обрабатывает специальные символы в пароле)
+            from urllib.parse import urlparse, unquote
+            parsed = urlparse(db_url)
+            
+            # Декодируем пароль, если он был закодирован
+            password = unquote(parsed.password) if parsed.password else None
+            
+            _pool = await asyncpg.create_pool(
+                host=parsed.hostname,
+                port=parsed.port or 5432,
+                user=unquote(parsed.username) if parsed.username else None,
+                password=password,
+                database=unquote(parsed.path.lstrip('/')) if parsed.path else None,
+                min_size=Config.DB_POOL_MIN,
+                max_size=Config.DB_POOL_MAX,
+                max_queries=Config.DB_POOL_MAX_QUERIES,
+                # Зависший запрос не должен держать соединение пула бесконечно
+                command_timeout=10,
+                # Простаивающие соединения переоткрываются, чтобы не упираться в обрывы по таймауту
+                max_inactive_connection_lifetime=1800,
+                # Запросы модуля - фиксированные строки, asyncpg подготавливает каждую один раз на соединение
+                statement_cache_size=Config.DB_STATEMENT_CACHE_SIZE,
+                # Не ждем fsync WAL на каждый COMMIT: при сбое сервера БД можно потерять
+                # лишь последние доли секунды записей, но целостность данных сохраняется.
+                # JIT только замедляет наши короткие запросы
+                server_settings={'synchronous_commit': 'off', 'jit': 'off'}
+            )
+            logger.info("Пул соединений с БД создан (драйвер asyncpg, хост %s)", parsed.hostname)
+        return _pool
 
 
 async def init_db():
@@ -53,148 +123,153 @@ async def init_db():
     pool = await get_pool()
     
     async with pool.acquire() as conn:
-        # Создаем таблицу calendar_events
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS calendar_events (
-                id SERIAL PRIMARY KEY,
-                event_id VARCHAR(255) UNIQUE NOT NULL,
-                summary VARCHAR(255) NOT NULL,
-                description TEXT,
-                start_datetime TIMESTAMP NOT NULL,
-                end_datetime TIMESTAMP NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                notified_15min BOOLEAN DEFAULT FALSE,
-                notified_60min BOOLEAN DEFAULT FALSE,
-                telegram_user_id INTEGER NOT NULL
-            )
-        """)
-        
-        # Создаем таблицу notifications
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS notifications (
-                id SERIAL PRIMARY KEY,
-                event_id INTEGER NOT NULL,
-                notification_time TIMESTAMP NOT NULL,
-                sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Создаем таблицу user_credentials
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_credentials (
-                id SERIAL PRIMARY KEY,
-                telegram_user_id INTEGER UNIQUE NOT NULL,
-                yandex_user VARCHAR(255) NOT NULL,
-                yandex_password VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        async with conn.transaction():
+            # Блокировка не дает нескольким экземплярам бота выполнять DDL одновременно
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", _SCHEMA_LOCK_ID)
+            # Вся схема создается одним запросом (один round-trip до сервера)
+            await conn.execute(_SCHEMA_SQL)
         
         logger.info("Таблицы базы данных созданы/проверены")
 
 
+@asynccontextmanager
+async def _acquire(conn: Optional[asyncpg.Connection] = None):
+    """
+    Соединение для запроса: переданное вызывающим кодом (чтобы несколько
+    операций выполнялись на одном соединении) или новое из пула
+    """
+    if conn is not None:
+        yield conn
+        return
+    pool = await get_pool()
+    async with pool.acquire() as pool_conn:
+        yield pool_conn
+
+
+def _to_utc_naive(value: datetime, timezone) -> datetime:
+    """
+    Конвертация datetime в naive UTC для сохранения в БД
+    (asyncpg требует naive datetime для TIMESTAMP полей PostgreSQL)
+    """
+    if value.tzinfo is None:
+        # Если datetime naive, считаем что это уже в локальном timezone
+        # (в отличие от pytz.localize, для неоднозначного времени при переводе часов берется fold=0)
+        value = value.replace(tzinfo=timezone)
+    return value.astimezone(_UTC).replace(tzinfo=None)
+
+
 # Функции для работы с CalendarEvent
-async def create_calendar_event(
-    event_id: str,
-    summary: str,
-    start_datetime: datetime,
-    end_datetime: datetime,
+async def create_calendar_events_bulk(
+    events: List[Dict[str, Any]],
     telegram_user_id: int,
-    description: Optional[str] = None
-) -> int:
-    """Создание события календаря"""
-    # Конвертируем datetime в UTC для сохранения в БД
-    # asyncpg требует naive datetime для TIMESTAMP полей PostgreSQL
-    timezone = pytz.timezone(Config.TIMEZONE)
+    *,
+    conn: Optional[asyncpg.Connection] = None
+) -> List[int]:
+    """
+    Создание нескольких событий календаря и их уведомлений в одной транзакции
     
-    if start_datetime.tzinfo is not None:
-        start_datetime = start_datetime.astimezone(pytz.UTC).replace(tzinfo=None)
-    else:
-        # Если datetime naive, считаем что это уже в локальном timezone и конвертируем в UTC
-        start_datetime = timezone.localize(start_datetime).astimezone(pytz.UTC).replace(tzinfo=None)
-    
-    if end_datetime.tzinfo is not None:
-        end_datetime = end_datetime.astimezone(pytz.UTC).replace(tzinfo=None)
-    else:
-        # Если datetime naive, считаем что это уже в локальном timezone и конвертируем в UTC
-        end_datetime = timezone.localize(end_datetime).astimezone(pytz.UTC).replace(tzinfo=None)
+    Args:
+        events: Список словарей с ключами event_id, summary, start, end и (опционально)
+            description и notification_times - время уведомлений для события
+        telegram_user_id: ID пользователя Telegram
+        conn: Соединение вызывающего кода (если не указано, берется из пула)
+        
+    Returns:
+        Список ID созданных записей в том же порядке, что и events
+    """
+    timezone = _TZ
     
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            INSERT INTO calendar_events 
-            (event_id, summary, description, start_datetime, end_datetime, telegram_user_id, created_at, notified_15min, notified_60min)
-            VALUES ($1, $2, $3, $4, $5, $6, CURRENT_TIMESTAMP, FALSE, FALSE)
-            RETURNING id
-        """, event_id, summary, description, start_datetime, end_datetime, telegram_user_id)
-        return row['id']
+    async with _acquire(conn) as conn:
+        async with conn.transaction():
+            # Все события вставляются одним запросом
+            records = await conn.fetch("""
+                INSERT INTO calendar_events 
+                (event_id, summary, description, start_datetime, end_datetime, telegram_user_id)
+                SELECT e.event_id, e.summary, e.description, e.start_datetime, e.end_datetime, $6
+                FROM unnest($1::varchar[], $2::varchar[], $3::text[], $4::timestamp[], $5::timestamp[])
+                    AS e(event_id, summary, description, start_datetime, end_datetime)
+                RETURNING id, event_id
+            """,
+                [event["event_id"] for event in events],
+                [event["summary"] for event in events],
+                [event.get("description") for event in events],
+                [_to_utc_naive(event["start"], timezone) for event in events],
+                [_to_utc_naive(event["end"], timezone) for event in events],
+                telegram_user_id
+            )
+            # Порядок RETURNING не гарантирован, сопоставляем по event_id
+            ids_by_event_id = {record['event_id']: record['id'] for record in records}
+            ids = [ids_by_event_id[event["event_id"]] for event in events]
+            
+            notification_rows = [
+                (event_id, _to_utc_naive(notification_time, timezone))
+                for event_id, event in zip(ids, events)
+                for notification_time in event.get("notification_times", ())
+            ]
+            await _insert_notifications(conn, notification_rows)
+            return ids
 
 
-async def get_calendar_event_by_id(event_id: int) -> Optional[Dict[str, Any]]:
+async def get_calendar_event_by_id(
+    event_id: int,
+    *,
+    conn: Optional[asyncpg.Connection] = None
+) -> Optional[asyncpg.Record]:
     """Получение события по ID"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         row = await conn.fetchrow("""
             SELECT * FROM calendar_events WHERE id = $1
         """, event_id)
-        return dict(row) if row else None
+        return row
 
 
-async def get_calendar_event_by_event_id(event_id: str) -> Optional[Dict[str, Any]]:
+async def get_calendar_event_by_event_id(
+    event_id: str,
+    *,
+    conn: Optional[asyncpg.Connection] = None
+) -> Optional[asyncpg.Record]:
     """Получение события по event_id (ID из Яндекс Календаря)"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         row = await conn.fetchrow("""
             SELECT * FROM calendar_events WHERE event_id = $1
         """, event_id)
-        return dict(row) if row else None
+        return row
 
 
 # Функции для работы с Notification
-async def create_notification(event_id: int, notification_time: datetime) -> int:
-    """Создание уведомления"""
-    # Конвертируем datetime в UTC для сохранения в БД
-    # asyncpg требует naive datetime для TIMESTAMP полей PostgreSQL
-    timezone = pytz.timezone(Config.TIMEZONE)
-    
-    if notification_time.tzinfo is not None:
-        notification_time = notification_time.astimezone(pytz.UTC).replace(tzinfo=None)
-    else:
-        # Если datetime naive, считаем что это уже в локальном timezone и конвертируем в UTC
-        notification_time = timezone.localize(notification_time).astimezone(pytz.UTC).replace(tzinfo=None)
-    
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
-            INSERT INTO notifications (event_id, notification_time, sent, created_at)
-            VALUES ($1, $2, FALSE, CURRENT_TIMESTAMP)
-            RETURNING id
-        """, event_id, notification_time)
-        return row['id']
+async def _insert_notifications(conn: asyncpg.Connection, rows: List[Tuple[int, datetime]]):
+    """Вставка уведомлений (ID события, naive UTC время) одним INSERT"""
+    if not rows:
+        return
+    event_ids, notification_times = zip(*rows)
+    await conn.execute("""
+        INSERT INTO notifications (event_id, notification_time)
+        SELECT event_id, notification_time
+        FROM unnest($1::integer[], $2::timestamp[]) AS n(event_id, notification_time)
+    """, list(event_ids), list(notification_times))
 
 
 async def get_pending_notifications(
     check_time: datetime,
-    now: datetime
-) -> List[Dict[str, Any]]:
+    now: datetime,
+    *,
+    conn: Optional[asyncpg.Connection] = None
+) -> List[asyncpg.Record]:
     """Получение уведомлений, которые нужно отправить"""
     # Убеждаемся, что все datetime в UTC и naive для передачи в БД
     # asyncpg требует naive datetime для TIMESTAMP полей PostgreSQL
     if check_time.tzinfo is not None:
-        check_time = check_time.astimezone(pytz.UTC).replace(tzinfo=None)
+        check_time = check_time.astimezone(_UTC).replace(tzinfo=None)
     # Если naive, считаем что это уже UTC, ничего не делаем
     
     if now.tzinfo is not None:
-        now = now.astimezone(pytz.UTC).replace(tzinfo=None)
+        now = now.astimezone(_UTC).replace(tzinfo=None)
     # Если naive, считаем что это уже UTC, ничего не делаем
     
     # Вычисляем нижнюю границу времени для проверки
     lower_bound = now - timedelta(minutes=1)
     
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+    async with _acquire(conn) as conn:
         rows = await conn.fetch("""
             SELECT n.*, ce.summary, ce.telegram_user_id, ce.start_datetime
             FROM notifications n
@@ -203,46 +278,71 @@ async def get_pending_notifications(
             AND n.notification_time <= $1
             AND n.notification_time >= $2
         """, check_time, lower_bound)
-        return [dict(row) for row in rows]
+        return rows
 
 
-async def mark_notification_sent(notification_id: int):
-    """Пометить уведомление как отправленное"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
+async def mark_notifications_sent(
+    notification_ids: List[int],
+    *,
+    conn: Optional[asyncpg.Connection] = None
+):
+    """Пометить несколько уведомлений как отправленные одним запросом"""
+    if not notification_ids:
+        return
+    
+    async with _acquire(conn) as conn:
         await conn.execute("""
-            UPDATE notifications SET sent = TRUE WHERE id = $1
-        """, notification_id)
+            UPDATE notifications SET sent = TRUE WHERE id = ANY($1::integer[])
+        """, notification_ids)
 
 
 # Функции для работы с UserCredentials
-async def get_user_credentials(telegram_user_id: int) -> Optional[Dict[str, Any]]:
-    """Получение учетных данных пользователя"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("""
+async def get_user_credentials(
+    telegram_user_id: int,
+    *,
+    conn: Optional[asyncpg.Connection] = None
+) -> Optional[asyncpg.Record]:
+    """
+    Получение учетных данных пользователя
+    
+    С переданным соединением кэш не используется: внутри транзакции
+    должны быть видны ее собственные изменения
+    """
+    if conn is None and telegram_user_id in _credentials_cache:
+        return _credentials_cache[telegram_user_id]
+    
+    generation = _credentials_generation
+    async with _acquire(conn) as acquired_conn:
+        row = await acquired_conn.fetchrow("""
             SELECT * FROM user_credentials WHERE telegram_user_id = $1
         """, telegram_user_id)
-        return dict(row) if row else None
+    
+    # Record неизменяем, поэтому его можно безопасно отдавать из кэша
+    if conn is None and generation == _credentials_generation:
+        _credentials_cache[telegram_user_id] = row
+    return row
 
 
 async def save_user_credentials(
     telegram_user_id: int,
     yandex_user: str,
-    yandex_password: str
+    yandex_password: str,
+    *,
+    conn: Optional[asyncpg.Connection] = None
 ):
     """Сохранение или обновление учетных данных пользователя"""
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        existing = await get_user_credentials(telegram_user_id)
-        if existing:
-            await conn.execute("""
-                UPDATE user_credentials
-                SET yandex_user = $1, yandex_password = $2, updated_at = CURRENT_TIMESTAMP
-                WHERE telegram_user_id = $3
-            """, yandex_user, yandex_password, telegram_user_id)
-        else:
-            await conn.execute("""
-                INSERT INTO user_credentials (telegram_user_id, yandex_user, yandex_password)
-                VALUES ($1, $2, $3)
-            """,                 telegram_user_id, yandex_user, yandex_password)
+    async with _acquire(conn) as conn:
+        await conn.execute("""
+            INSERT INTO user_credentials (telegram_user_id, yandex_user, yandex_password)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (telegram_user_id) DO UPDATE
+            SET yandex_user = EXCLUDED.yandex_user,
+                yandex_password = EXCLUDED.yandex_password,
+                updated_at = CURRENT_TIMESTAMP
+        """, telegram_user_id, yandex_user, yandex_password)
+    
+    # Сбрасываем кэш, чтобы следующее чтение получило новые данные,
+    # а начатые до сохранения чтения не вернули в кэш старую строку
+    global _credentials_generation
+    _credentials_generation += 1
+    _credentials_cache.pop(telegram_user_id, None)
@@ -3,12 +3,21 @@ import asyncio
 import logging
 from bot import main
 
+try:
+    # Более быстрый цикл событий (недоступен на Windows)
+    import uvloop
+except ImportError:
+    uvloop = None
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
+    if uvloop is not None:
+        uvloop.install()
+    
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1,16 +1,154 @@
 """Сервис обработки естественного языка для извлечения данных о событиях"""
+import asyncio
 import google.generativeai as genai
+from google.api_core.exceptions import ResourceExhausted
+from cachetools import TTLCache
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Sequence, Tuple, Union
 from config import Config
-import json
+import msgspec
+import re
+import time
+from functools import lru_cache
 import logging
-import pytz
-import asyncio
+from zoneinfo import ZoneInfo
 from dateutil import parser
 
 logger = logging.getLogger(__name__)
 
+# Часовой пояс пользователя (создается один раз при импорте)
+_TZ = ZoneInfo(Config.TIMEZONE)
+
+# Обрамление markdown-блока кода вокруг JSON в ответе модели
+_CODE_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class _EventPayload(msgspec.Struct):
+    """
+    Событие в ответе модели (значения по умолчанию - для пропущенных полей;
+    название и время обязательны только для create_event и проверяются при разборе)
+    """
+    action: str = "create_event"
+    summary: Optional[str] = None
+    start_datetime: Optional[str] = None
+    duration_minutes: Optional[Union[int, float]] = 60
+    description: Optional[str] = None
+
+
+# Ответ модели - одно событие или массив событий; strict=False допускает числа в виде строк.
+# Элементы массива разбираются по отдельности, чтобы одно некорректное событие не отбрасывало остальные
+_EVENTS_DECODER = msgspec.json.Decoder(Union[List[msgspec.Raw], _EventPayload], strict=False)
+_EVENT_DECODER = msgspec.json.Decoder(_EventPayload, strict=False)
+
+# Шаблонные команды, которые разбираются без обращения к модели:
+# "Напомни завтра в 15:00 про звонок" (время - только в формате ЧЧ:ММ, чтобы не гадать утро или вечер)
+_SIMPLE_COMMAND_RE = re.compile(
+    r"^напомни(?:\s+мне)?[\s,]+(сегодня|завтра|послезавтра)[\s,]+в\s+"
+    r"(\d{1,2})[:.](\d{2})[\s,]+про\s+(.+?)[.!]*$",
+    re.IGNORECASE
+)
+_DAY_OFFSETS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+# Признаки того, что после "про" идет не только название: числа (время, длительность),
+# еще один день или еще одно "про"/"в" (второе событие), длительность словами
+_COMPLEX_SUMMARY_RE = re.compile(
+    r"\d|\b(?:сегодня|завтра|послезавтра|про|в)\b|\b(?:час|минут)",
+    re.IGNORECASE
+)
+
+
+def _match_simple_command(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Разбор шаблонной команды без обращения к модели
+    
+    Returns:
+        Информация о событии или None, если текст не подходит под шаблон
+    """
+    match = _SIMPLE_COMMAND_RE.match(text.strip())
+    if match is None:
+        return None
+    
+    day, hour, minute, summary = match.groups()
+    hour = int(hour)
+    minute = int(minute)
+    # Несколько событий или длительность в тексте разбирает модель
+    if hour > 23 or minute > 59 or _COMPLEX_SUMMARY_RE.search(summary):
+        return None
+    
+    date = datetime.now(_TZ).date() + timedelta(days=_DAY_OFFSETS[day.lower()])
+    summary = summary.strip()
+    return {
+        "action": "create_event",
+        "summary": summary[:1].upper() + summary[1:],
+        "start_datetime": datetime(date.year, date.month, date.day, hour, minute, tzinfo=_TZ),
+        "duration_minutes": 60,
+        "description": None
+    }
+
+
+@lru_cache(maxsize=4)
+def _current_date_strings(epoch_second: int) -> Tuple[str, str, str, str]:
+    """
+    Текущие дата и время, дата, день недели и завтрашняя дата для промпта
+    (кэшируются в пределах одной секунды)
+    """
+    current_datetime = datetime.fromtimestamp(epoch_second, _TZ)
+    return (
+        current_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+        current_datetime.strftime("%Y-%m-%d"),
+        current_datetime.strftime("%A"),  # День недели для контекста
+        (current_datetime + timedelta(days=1)).strftime("%Y-%m-%d")
+    )
+
+
+# Шаблон промпта для Gemini: собирается один раз, при запросе подставляются только дата и текст
+_PROMPT_TEMPLATE = """Ты — помощник для управления календарем. Твоя задача — извлечь из текста пользователя детали событий и вернуть их в формате JSON.
+
+Текущая дата и время: {current_date_str} ({weekday_name}, часовой пояс: {timezone})
+Сегодня: {current_date_only}
+
+Текст пользователя: "{text}"
+
+ВАЖНО: Если пользователь просит создать несколько событий (например, "2 задачи", "несколько событий", перечисляет несколько задач), верни МАССИВ событий.
+
+Верни строго JSON со следующей структурой:
+- Если одно событие: объект {{"action": "create_event", "summary": "...", "start_datetime": "...", "duration_minutes": 60, "description": null}}
+- Если несколько событий: массив [{{"action": "create_event", "summary": "...", ...}}, {{"action": "create_event", "summary": "...", ...}}]
+
+Структура одного события:
+{{
+    "action": "create_event" | "delete_event" | "update_event",
+    "summary": "Название события",
+    "start_datetime": "YYYY-MM-DD HH:MM:SS",
+    "duration_minutes": 60,
+    "description": "Описание (опционально, может быть null)"
+}}
+
+Правила:
+1. Если пользователь говорит "сегодня", используй текущую дату ({current_date_only})
+2. Если пользователь говорит "завтра", "послезавтра", "через 3 дня" — вычисли правильную дату относительно текущей даты ({current_date_str})
+3. Если указано время без даты (например, "в 3 часа дня"), используй сегодняшнюю дату, если событие еще не прошло, иначе завтрашнюю
+4. Если время не указано, используй 12:00 по умолчанию
+5. Если длительность не указана, используй 60 минут по умолчанию
+6. Если пользователь просит удалить или изменить событие, укажи action соответственно
+7. Если пользователь передумал внутри фразы (например, "на завтра, ой нет, на послезавтра"), бери последнее утверждение
+8. Если пользователь просит создать несколько событий, извлеки ВСЕ события и верни их в массиве
+9. Всегда возвращай валидный JSON, без дополнительного текста или комментариев
+
+Примеры:
+- "Поставь встречу с клиентом на завтра в 15:00" -> {{"action": "create_event", "summary": "Встреча с клиентом", "start_datetime": "{tomorrow_date} 15:00:00", "duration_minutes": 60, "description": null}}
+- "Сегодня с 13 до 16 уборка, потом с 16 до 20 магазин" -> [{{"action": "create_event", "summary": "Уборка", "start_datetime": "{current_date_only} 13:00:00", "duration_minutes": 180, "description": null}}, {{"action": "create_event", "summary": "Магазин", "start_datetime": "{current_date_only} 16:00:00", "duration_minutes": 240, "description": null}}]
+
+Верни только JSON:"""
+
+
+def _build_rotations(models: List[str]) -> Dict[str, List[str]]:
+    """Для каждой модели - список всех моделей, начиная с нее и по кругу"""
+    return {
+        model_name: models[index:] + models[:index]
+        for index, model_name in enumerate(models)
+    }
+
+
 class NLUService:
     """Сервис для обработки текста и извлечения информации о событиях"""
     
@@ -21,26 +159,78 @@ class NLUService:
         'gemini-1.5-pro',    # Приоритет 3 - более мощная модель
         'gemini-pro'         # Приоритет 4 - legacy версия для совместимости
     ]
+    # Порядок перебора моделей, начиная с каждой из них
+    _ROTATIONS = _build_rotations(MODEL_PRIORITIES)
+    
+    # Параметры генерации, общие для всех моделей
+    _GENERATION_CONFIG = {
+        "response_mime_type": "application/json",
+        "temperature": 0.3
+    }
+    
+    # Сколько секунд ключ с исчерпанной квотой не используется
+    _KEY_COOLDOWN_SECONDS = 60
     
     def __init__(self):
-        genai.configure(api_key=Config.GEMINI_API_KEY)
+        self._api_keys = Config.GEMINI_API_KEYS
+        self._api_key_index = 0
+        # Время (time.monotonic), до которого ключ не используется
+        self._api_key_cooldown: Dict[str, float] = {}
+        genai.configure(api_key=self._api_keys[0] if self._api_keys else Config.GEMINI_API_KEY)
         self.model = None
         self.model_name = None
-        self.timezone = pytz.timezone(Config.TIMEZONE)
+        # Результаты разбора повторяющихся фраз (повторная отправка того же голосового)
+        self._results_cache = TTLCache(maxsize=1024, ttl=120)
+        # Статистика попаданий в кэш результатов
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Созданные объекты моделей (переиспользуются при переключении между ними)
+        self._models: Dict[str, genai.GenerativeModel] = {}
         self._initialize_model()
     
+    def _get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Получение объекта модели (создается один раз для каждого имени)"""
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name, generation_config=self._GENERATION_CONFIG)
+            self._models[model_name] = model
+        return model
+    
+    def _rotate_api_key(self) -> bool:
+        """
+        Переключение на следующий ключ API после исчерпания квоты текущего
+        
+        Returns:
+            True, если найден ключ, который не находится в ожидании сброса квоты
+        """
+        if len(self._api_keys) < 2:
+            return False
+        
+        now = time.monotonic()
+        self._api_key_cooldown[self._api_keys[self._api_key_index]] = now + self._KEY_COOLDOWN_SECONDS
+        
+        for offset in range(1, len(self._api_keys)):
+            index = (self._api_key_index + offset) % len(self._api_keys)
+            if self._api_key_cooldown.get(self._api_keys[index], 0) <= now:
+                break
+        else:
+            return False
+        
+        self._api_key_index = index
+        genai.configure(api_key=self._api_keys[index])
+        # Объекты моделей привязаны к клиенту со старым ключом
+        self._models.clear()
+        if self.model_name is not None:
+            self.model = self._get_model(self.model_name)
+        logger.warning("Квота ключа Gemini исчерпана, переключаемся на ключ #%d", index + 1)
+        return True
+    
     def _initialize_model(self):
         """Инициализация модели Gemini с автоматическим fallback"""
         for model_name in self.MODEL_PRIORITIES:
             try:
                 logger.info(f"Попытка инициализации модели: {model_name}")
-                model = genai.GenerativeModel(
-                    model_name,
-                    generation_config={
-                        "response_mime_type": "application/json",
-                        "temperature": 0.3
-                    }
-                )
+                model = self._get_model(model_name)
                 self.model = model
                 self.model_name = model_name
                 logger.info(f"Успешно инициализирована модель: {model_name}")
@@ -63,13 +253,7 @@ class NLUService:
         for model_name in self.MODEL_PRIORITIES:
             try:
                 logger.info(f"Попытка инициализации модели: {model_name}")
-                model = genai.GenerativeModel(
-                    model_name,
-                    generation_config={
-                        "response_mime_type": "application/json",
-                        "temperature": 0.3
-                    }
-                )
+                model = self._get_model(model_name)
                 self.model = model
                 self.model_name = model_name
                 logger.info(f"Успешно инициализирована модель: {model_name}")
@@ -82,197 +266,239 @@ class NLUService:
     
     def _get_current_datetime(self) -> datetime:
         """Получение текущей даты и времени в нужном часовом поясе"""
-        return datetime.now(self.timezone)
+        return datetime.now(_TZ)
     
     def _create_prompt(self, text: str) -> str:
         """Создание промпта для Gemini"""
-        current_datetime = self._get_current_datetime()
-        current_date_str = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
-        current_date_only = current_datetime.strftime("%Y-%m-%d")
-        weekday_name = current_datetime.strftime("%A")  # День недели для контекста
-        
-        prompt = f"""Ты — помощник для управления календарем. Твоя задача — извлечь из текста пользователя детали событий и вернуть их в формате JSON.
-
-Текущая дата и время: {current_date_str} ({weekday_name}, часовой пояс: {Config.TIMEZONE})
-Сегодня: {current_date_only}
-
-Текст пользователя: "{text}"
-
-ВАЖНО: Если пользователь просит создать несколько событий (например, "2 задачи", "несколько событий", перечисляет несколько задач), верни МАССИВ событий.
-
-Верни строго JSON со следующей структурой:
-- Если одно событие: объект {{"action": "create_event", "summary": "...", "start_datetime": "...", "duration_minutes": 60, "description": null}}
-- Если несколько событий: массив [{{"action": "create_event", "summary": "...", ...}}, {{"action": "create_event", "summary": "...", ...}}]
-
-Структура одного события:
-{{
-    "action": "create_event" | "delete_event" | "update_event",
-    "summary": "Название события",
-    "start_datetime": "YYYY-MM-DD HH:MM:SS",
-    "duration_minutes": 60,
-    "description": "Описание (опционально, может быть null)"
-}}
-
-Правила:
-1. Если пользователь говорит "сегодня", используй текущую дату ({current_date_only})
-2. Если пользователь говорит "завтра", "послезавтра", "через 3 дня" — вычисли правильную дату относительно текущей даты ({current_date_str})
-3. Если указано время без даты (например, "в 3 часа дня"), используй сегодняшнюю дату, если событие еще не прошло, иначе завтрашнюю
-4. Если время не указано, используй 12:00 по умолчанию
-5. Если длительность не указана, используй 60 минут по умолчанию
-6. Если пользователь просит удалить или изменить событие, укажи action соответственно
-7. Если пользователь передумал внутри фразы (например, "на завтра, ой нет, на послезавтра"), бери последнее утверждение
-8. Если пользователь просит создать несколько событий, извлеки ВСЕ события и верни их в массиве
-9. Всегда возвращай валидный JSON, без дополнительного текста или комментариев
-
-Примеры:
-- "Поставь встречу с клиентом на завтра в 15:00" -> {{"action": "create_event", "summary": "Встреча с клиентом", "start_datetime": "2025-01-15 15:00:00", "duration_minutes": 60, "description": null}}
-- "Поставь задачу на сегодня в 18:00" -> {{"action": "create_event", "summary": "Задача", "start_datetime": "{current_date_only} 18:00:00", "duration_minutes": 60, "description": null}}
-- "Поставь мне задачу на 28 декабря 2 штуки значит 1 с 13 до 16 уборка дома с 16 до 20 поход в магазин" -> [{{"action": "create_event", "summary": "Уборка дома", "start_datetime": "2025-12-28 13:00:00", "duration_minutes": 180, "description": null}}, {{"action": "create_event", "summary": "Поход в магазин", "start_datetime": "2025-12-28 16:00:00", "duration_minutes": 240, "description": null}}]
-- "Созвон с командой послезавтра в 10 утра на час" -> {{"action": "create_event", "summary": "Созвон с командой", "start_datetime": "2025-01-16 10:00:00", "duration_minutes": 60, "description": null}}
-- "Тренировка в пятницу в 6 вечера на полтора часа" -> {{"action": "create_event", "summary": "Тренировка", "start_datetime": "2025-01-17 18:00:00", "duration_minutes": 90, "description": null}}
-
-Верни только JSON:"""
+        current_date_str, current_date_only, weekday_name, tomorrow_date = _current_date_strings(int(time.time()))
         
-        return prompt
+        return _PROMPT_TEMPLATE.format(
+            text=text,
+            current_date_str=current_date_str,
+            current_date_only=current_date_only,
+            weekday_name=weekday_name,
+            tomorrow_date=tomorrow_date,
+            timezone=Config.TIMEZONE
+        )
     
-    def _try_models_with_fallback(self, prompt: str) -> str:
+    async def _try_models_with_fallback(self, prompt: str, skip_models: Sequence[str] = ()) -> str:
         """
         Выполняет запрос к модели с автоматическим fallback на следующую модель при ошибке
         
         Args:
             prompt: Промпт для отправки в модель
+            skip_models: Модели, которые не нужно пробовать (уже отказали)
             
         Returns:
             Текст ответа от модели
         """
-        # Список моделей для попытки (начинаем с текущей, затем пробуем остальные)
-        models_to_try = []
-        if self.model_name:
-            # Начинаем с текущей модели
-            current_index = self.MODEL_PRIORITIES.index(self.model_name) if self.model_name in self.MODEL_PRIORITIES else 0
-            models_to_try = self.MODEL_PRIORITIES[current_index:] + self.MODEL_PRIORITIES[:current_index]
-        else:
-            # Если модель не инициализирована, пробуем все по порядку
-            models_to_try = self.MODEL_PRIORITIES
+        # Список моделей для попытки (начинаем с текущей, затем пробуем остальные;
+        # если модель не инициализирована, пробуем все по порядку)
+        models_to_try = [
+            model_name
+            for model_name in self._ROTATIONS.get(self.model_name, self.MODEL_PRIORITIES)
+            if model_name not in skip_models
+        ]
         
         last_error = None
         for model_name in models_to_try:
-            try:
-                # Если это не текущая модель, создаем новую
-                if model_name != self.model_name:
-                    logger.info(f"Попытка использовать модель: {model_name}")
-                    model = genai.GenerativeModel(
-                        model_name,
-                        generation_config={
-                            "response_mime_type": "application/json",
-                            "temperature": 0.3
-                        }
-                    )
-                else:
-                    model = self.model
-                
-                # Выполняем запрос
-                response = model.generate_content(prompt)
-                result_text = response.text.strip()
-                
-                # Если успешно и использовали другую модель, обновляем текущую
-                if model_name != self.model_name:
-                    self.model = model
-                    self.model_name = model_name
-                    logger.info(f"Успешно переключились на модель: {model_name}")
-                
-                return result_text
-                
-            except Exception as e:
-                logger.warning(f"Ошибка при использовании модели {model_name}: {e}")
-                last_error = e
-                continue
+            # Каждую модель пробуем с каждым из ключей, пока у них не исчерпана квота
+            for _ in range(max(1, len(self._api_keys))):
+                try:
+                    # Если это не текущая модель, берем ее объект из кэша
+                    if model_name != self.model_name:
+                        logger.info(f"Попытка использовать модель: {model_name}")
+                        model = self._get_model(model_name)
+                    else:
+                        model = self.model
+                    
+                    # Выполняем запрос
+                    response = await model.generate_content_async(prompt)
+                    result_text = response.text.strip()
+                    
+                    # Если успешно и использовали другую модель, обновляем текущую
+                    if model_name != self.model_name:
+                        self.model = model
+                        self.model_name = model_name
+                        logger.info(f"Успешно переключились на модель: {model_name}")
+                    
+                    return result_text
+                    
+                except Exception as e:
+                    logger.warning(f"Ошибка при использовании модели {model_name}: {e}")
+                    last_error = e
+                    if isinstance(e, ResourceExhausted) and self._rotate_api_key():
+                        continue
+                    break
         
         # Если все модели не сработали, выбрасываем последнюю ошибку
         raise RuntimeError(f"Не удалось выполнить запрос ни к одной из моделей. Последняя ошибка: {last_error}")
     
-    async def extract_event_info(self, text: str) -> List[Dict[str, Any]]:
+    async def _race_models(self, prompt: str, k: int = 2) -> str:
+        """
+        Отправляет запрос сразу в k моделей и возвращает первый успешный ответ
+        
+        Остальные запросы отменяются. Если ни одна из k моделей не ответила,
+        по очереди перебираются остальные модели.
+        
+        Args:
+            prompt: Промпт для отправки в модель
+            k: Количество моделей, опрашиваемых одновременно
+            
+        Returns:
+            Текст ответа от модели
+        """
+        models_to_try = self._ROTATIONS.get(self.model_name, self.MODEL_PRIORITIES)[:k]
+        tasks = {
+            asyncio.create_task(self._get_model(model_name).generate_content_async(prompt)): model_name
+            for model_name in models_to_try
+        }
+        pending = set(tasks)
+        key_rotated = False
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # Разбираем все завершившиеся задачи, даже если первая успешна:
+                # иначе исключения остальных останутся непрочитанными
+                winner = None
+                for task in done:
+                    model_name = tasks[task]
+                    try:
+                        result_text = task.result().text.strip()
+                    except Exception as e:
+                        logger.warning(f"Ошибка при использовании модели {model_name}: {e}")
+                        # Все задачи используют один ключ - меняем его один раз,
+                        # чтобы последовательный перебор шел уже с другим ключом
+                        if isinstance(e, ResourceExhausted) and not key_rotated:
+                            key_rotated = self._rotate_api_key()
+                        continue
+                    
+                    if winner is None:
+                        winner = (model_name, result_text)
+                
+                if winner is not None:
+                    model_name, result_text = winner
+                    if model_name != self.model_name:
+                        self.model = self._get_model(model_name)
+                        self.model_name = model_name
+                        logger.info(f"Успешно переключились на модель: {model_name}")
+                    return result_text
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        logger.warning("Ни одна из моделей не ответила при параллельном запросе, пробуем по очереди")
+        # Модели из гонки уже отказали - последовательный перебор начинается со следующих
+        return await self._try_models_with_fallback(prompt, skip_models=models_to_try)
+    
+    async def extract_event_info(self, text: str, fast: bool = False) -> List[Dict[str, Any]]:
         """
         Извлечение информации о событиях из текста через Gemini с автоматическим fallback
         
         Args:
             text: Транскрибированный текст
+            fast: Опрашивать несколько моделей одновременно (быстрее, но расходует больше квоты)
             
         Returns:
             Список словарей с информацией о событиях (может содержать одно или несколько событий)
         """
+        # Шаблонные команды разбираем сразу, без запроса к модели
+        simple_event = _match_simple_command(text)
+        if simple_event is not None:
+            logger.info("Информация о событии извлечена по шаблону: %s", simple_event)
+            return [simple_event]
+        
+        # Относительные даты ("завтра", "через час") зависят от текущего времени,
+        # поэтому результат кэшируется только в пределах одной минуты
+        cache_key = (
+            " ".join(text.lower().split()),
+            _current_date_strings(int(time.time()))[0][:16]
+        )
+        cached_events = self._results_cache.get(cache_key)
+        if cached_events is not None:
+            self.cache_hits += 1
+            logger.info(
+                "Информация о событиях взята из кэша (попаданий: %d, промахов: %d)",
+                self.cache_hits, self.cache_misses
+            )
+            return [dict(event) for event in cached_events]
+        self.cache_misses += 1
+        
         try:
             # Убеждаемся, что модель инициализирована
             self._ensure_model_initialized()
             
             prompt = self._create_prompt(text)
             
-            # Отправляем запрос к Gemini с автоматическим fallback (синхронный API, оборачиваем в executor)
-            loop = asyncio.get_event_loop()
-            result_text = await loop.run_in_executor(
-                None,
-                lambda: self._try_models_with_fallback(prompt)
-            )
+            # Отправляем запрос к Gemini с автоматическим fallback (асинхронный API, без потоков)
+            if fast:
+                result_text = await self._race_models(prompt)
+            else:
+                result_text = await self._try_models_with_fallback(prompt)
             
             # Убираем возможные markdown блоки кода, если они есть
-            if result_text.startswith("```json"):
-                result_text = result_text[7:]
-            if result_text.startswith("```"):
-                result_text = result_text[3:]
-            if result_text.endswith("```"):
-                result_text = result_text[:-3]
-            result_text = result_text.strip()
+            # (в режиме application/json модель обычно возвращает чистый JSON)
+            if "```" in result_text:
+                result_text = _CODE_FENCE_RE.sub("", result_text).strip()
             
-            # Парсим JSON
-            result = json.loads(result_text)
+            # Парсим JSON сразу в события (одно событие или массив) с проверкой структуры
+            result = _EVENTS_DECODER.decode(result_text)
             
             # Нормализуем результат: всегда возвращаем список
-            events = []
             if isinstance(result, list):
-                events = result
-            elif isinstance(result, dict):
-                # Если это одно событие, оборачиваем в список
-                events = [result]
+                events = []
+                for raw_event in result:
+                    try:
+                        events.append(_EVENT_DECODER.decode(raw_event))
+                    except msgspec.DecodeError as e:
+                        logger.warning(f"Пропущено некорректное событие в ответе Gemini: {e}")
             else:
-                logger.error(f"Неожиданный тип результата: {type(result)}, значение: {result}")
-                raise ValueError("Не удалось обработать ответ от модели. Попробуйте сформулировать иначе.")
+                events = [result]
             
             # Обрабатываем каждое событие
             processed_events = []
             for event in events:
-                if not isinstance(event, dict):
-                    logger.warning(f"Пропущено событие неверного типа: {type(event)}")
+                if event.action == "create_event" and (not event.summary or not event.start_datetime):
+                    logger.warning("Пропущено событие без названия или времени: %s", event)
                     continue
                 
-                # Парсим дату и время
-                if "start_datetime" in event:
-                    dt_str = event["start_datetime"]
+                event_info = msgspec.structs.asdict(event)
+                
+                # Длительность может прийти дробной или null - приводим к целым минутам
+                if event.duration_minutes is None:
+                    event_info["duration_minutes"] = 60
+                else:
+                    event_info["duration_minutes"] = int(event.duration_minutes)
+                
+                # Парсим дату и время (нужны только для создания события)
+                dt_str = event.start_datetime
+                if event.action == "create_event":
                     # Если дата без часового пояса, добавляем его
                     try:
-                        dt = parser.parse(dt_str)
+                        try:
+                            # Формат, который требует промпт
+                            dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
+                        except ValueError:
+                            dt = parser.parse(dt_str)
                         if dt.tzinfo is None:
-                            dt = self.timezone.localize(dt)
-                        event["start_datetime"] = dt
+                            dt = dt.replace(tzinfo=_TZ)
+                        event_info["start_datetime"] = dt
                     except Exception as e:
                         logger.error(f"Ошибка парсинга даты {dt_str}: {e}")
                         # Используем текущее время + 1 день как fallback
-                        event["start_datetime"] = self._get_current_datetime() + timedelta(days=1)
-                
-                # Устанавливаем значения по умолчанию
-                event.setdefault("action", "create_event")
-                event.setdefault("duration_minutes", 60)
-                event.setdefault("description", None)
+                        event_info["start_datetime"] = self._get_current_datetime() + timedelta(days=1)
                 
-                processed_events.append(event)
+                processed_events.append(event_info)
             
             if not processed_events:
                 logger.warning("Не удалось извлечь ни одного события из текста")
                 raise ValueError("Не удалось извлечь информацию о событиях. Попробуйте сформулировать иначе.")
             
-            logger.info(f"Извлечена информация о {len(processed_events)} событии(ях): {processed_events}")
+            logger.info("Извлечена информация о %d событии(ях): %s", len(processed_events), processed_events)
+            self._results_cache[cache_key] = [dict(event) for event in processed_events]
             return processed_events
             
-        except json.JSONDecodeError as e:
+        except msgspec.DecodeError as e:
             logger.error(f"Ошибка парсинга JSON от Gemini: {e}")
             logger.error(f"Ответ Gemini: {result_text if 'result_text' in locals() else 'N/A'}")
             raise ValueError("Не удалось обработать запрос. Попробуйте сформулировать иначе.")
@@ -0,0 +1,20 @@
+"""Ограничение частоты запросов к внешним API"""
+import asyncio
+
+
+class RateLimiter:
+    """Ограничение частоты запросов: не больше rate запросов в секунду"""
+    
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_time = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """Ожидание момента, когда можно отправить следующий запрос"""
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_time = max(loop.time(), self._next_time) + self._interval
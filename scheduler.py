@@ -1,102 +1,137 @@
 """Планировщик уведомлений"""
+import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from datetime import datetime, timedelta
-from database import create_notification as db_create_notification, get_pending_notifications, mark_notification_sent
+from typing import List, Optional
+from database import (
+    get_pending_notifications,
+    mark_notifications_sent,
+)
 from config import Config
+from rate_limiter import RateLimiter
 import logging
-import pytz
+from zoneinfo import ZoneInfo
 from aiogram import Bot
 
 logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler(timezone=Config.TIMEZONE)
 
+# Часовой пояс пользователя (создается один раз при импорте)
+_TZ = ZoneInfo(Config.TIMEZONE)
+_UTC = ZoneInfo("UTC")
 
-async def create_notifications(event_id: int, start_datetime: datetime):
+
+def get_notification_times(start_datetime: datetime) -> List[datetime]:
     """
-    Создание уведомлений для события
+    Вычисление времени уведомлений для события
     
     Args:
-        event_id: ID события в базе данных
         start_datetime: Дата и время начала события
+        
+    Returns:
+        Список времени уведомлений, которое еще не прошло
     """
-    timezone = pytz.timezone(Config.TIMEZONE)
+    timezone = _TZ
     
     # Убеждаемся, что start_datetime имеет timezone
     if start_datetime.tzinfo is None:
-        start_datetime = timezone.localize(start_datetime)
+        # (в отличие от pytz.localize, для неоднозначного времени при переводе часов берется fold=0)
+        start_datetime = start_datetime.replace(tzinfo=timezone)
     
     now = datetime.now(timezone)
     
-    for minutes_before in Config.NOTIFICATION_TIMES:
-        notification_time = start_datetime - timedelta(minutes=minutes_before)
+    notification_times = []
+    for delta in Config.NOTIFICATION_DELTAS:
+        notification_time = start_datetime - delta
         
         # Создаем уведомление только если время еще не прошло
         if notification_time > now:
-            await db_create_notification(event_id, notification_time)
+            notification_times.append(notification_time)
+    return notification_times
+
+
+# Лимит Telegram - около 30 сообщений в секунду: ограничитель задает частоту начала отправок,
+# семафор - число запросов, ожидающих ответа одновременно
+_send_rate_limiter = RateLimiter(30)
+_send_semaphore = asyncio.Semaphore(30)
+
+
+async def _send_notification(bot: Bot, notification, now: datetime, timezone) -> Optional[int]:
+    """
+    Отправка одного уведомления
+    
+    Returns:
+        ID уведомления, если оно отправлено, иначе None
+    """
+    # Данные события уже включены в результат запроса
+    event_summary = notification['summary']
+    telegram_user_id = notification['telegram_user_id']
+    # asyncpg всегда возвращает столбец TIMESTAMP как datetime
+    event_time: datetime = notification['start_datetime']
+    
+    # Если datetime из БД naive (без timezone), считаем что это UTC
+    if event_time.tzinfo is None:
+        event_time = event_time.replace(tzinfo=_UTC)
+    
+    # Конвертируем в локальный timezone для отображения
+    event_time_local = event_time.astimezone(timezone)
+    time_until = event_time_local - now
+    minutes_until = max(0, int(time_until.total_seconds() / 60))
     
-    logger.info(f"Созданы уведомления для события {event_id}")
+    message_text = (
+        f"🔔 Напоминание!\n\n"
+        f"📌 {event_summary}\n"
+        f"📅 {event_time_local.strftime('%d.%m.%Y в %H:%M')}\n"
+        f"⏰ Через {minutes_until} минут"
+    )
+    
+    try:
+        async with _send_semaphore:
+            await _send_rate_limiter.acquire()
+            await bot.send_message(
+                chat_id=telegram_user_id,
+                text=message_text
+            )
+        
+        logger.info("Отправлено уведомление для события %s", event_summary)
+        return notification['id']
+        
+    except Exception as e:
+        logger.error(f"Ошибка отправки уведомления: {e}")
+        return None
 
 
 async def check_and_send_notifications(bot: Bot):
     """Проверка и отправка уведомлений"""
     try:
-        timezone = pytz.timezone(Config.TIMEZONE)
+        timezone = _TZ
         # Находим уведомления, которые нужно отправить (в течение следующих 2 минут)
         now = datetime.now(timezone)
         check_time = now + timedelta(minutes=2)
         
         # Конвертируем в UTC для передачи в БД
-        now_utc = now.astimezone(pytz.UTC)
-        check_time_utc = check_time.astimezone(pytz.UTC)
+        now_utc = now.astimezone(_UTC)
+        check_time_utc = check_time.astimezone(_UTC)
         
         notifications = await get_pending_notifications(check_time_utc, now_utc)
         
-        for notification in notifications:
-            # Данные события уже включены в результат запроса
-            event_summary = notification['summary']
-            telegram_user_id = notification['telegram_user_id']
-            event_start = notification['start_datetime']
-            
-            # Отправляем уведомление
-            if isinstance(event_start, datetime):
-                event_time = event_start
-            else:
-                # Если это строка, парсим её
-                from dateutil import parser
-                event_time = parser.parse(str(event_start))
-            
-            # Если datetime из БД naive (без timezone), считаем что это UTC
-            if event_time.tzinfo is None:
-                event_time = pytz.UTC.localize(event_time)
-            
-            # Конвертируем в локальный timezone для отображения
-            event_time_local = event_time.astimezone(timezone)
-            time_until = event_time_local - now
-            minutes_until = max(0, int(time_until.total_seconds() / 60))
-            
-            message_text = (
-                f"🔔 Напоминание!\n\n"
-                f"📌 {event_summary}\n"
-                f"📅 {event_time_local.strftime('%d.%m.%Y в %H:%M')}\n"
-                f"⏰ Через {minutes_until} минут"
-            )
-            
-            try:
-                await bot.send_message(
-                    chat_id=telegram_user_id,
-                    text=message_text
-                )
-                
-                # Помечаем уведомление как отправленное
-                await mark_notification_sent(notification['id'])
-                
-                logger.info(f"Отправлено уведомление для события {event_summary}")
-                
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления: {e}")
-                    
+        # Уведомления отправляются параллельно
+        results = await asyncio.gather(
+            *(_send_notification(bot, notification, now, timezone) for notification in notifications),
+            return_exceptions=True
+        )
+        
+        # Отправленные уведомления помечаются в БД одним запросом после рассылки
+        sent_ids = []
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error(f"Ошибка обработки уведомления: {result}")
+            elif result is not None:
+                sent_ids.append(result)
+        await mark_notifications_sent(sent_ids)
+    
     except Exception as e:
         logger.error(f"Ошибка проверки уведомлений: {e}")
 
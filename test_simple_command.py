@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Тест разбора шаблонных команд без обращения к Gemini: простые команды разбираются сразу,
+сложные (несколько событий, длительность) передаются модели
+"""
+import os
+
+# Для импорта конфигурации достаточно фиктивных значений - модель не вызывается
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+from nlu_service import _match_simple_command
+
+SIMPLE_COMMANDS = {
+    "Напомни завтра в 15:00 про звонок": "Звонок",
+    "напомни мне сегодня в 9.30 про встречу с клиентом.": "Встречу с клиентом",
+}
+
+# Команды, которые шаблон разобрал бы неверно - их должна разбирать модель
+COMPLEX_COMMANDS = [
+    "напомни сегодня в 7:00 про зал, а завтра в 8 про работу",
+    "Напомни завтра в 15:00 про звонок маме на 2 часа",
+    "Напомни завтра в 15:00 про звонок маме на два часа",
+    "Напомни сегодня в 10:00 про отчет, потом в 12:00 про обед",
+    "Напомни завтра в 25:00 про звонок",
+]
+
+
+def test_simple_commands():
+    """Простые команды разбираются без модели"""
+    for text, summary in SIMPLE_COMMANDS.items():
+        event = _match_simple_command(text)
+        assert event is not None, text
+        assert event["summary"] == summary, event
+        assert event["duration_minutes"] == 60, event
+    print("✅ Простые команды разобраны по шаблону")
+
+
+def test_complex_commands():
+    """Сложные команды не разбираются шаблоном"""
+    for text in COMPLEX_COMMANDS:
+        event = _match_simple_command(text)
+        assert event is None, f"{text} -> {event}"
+    print("✅ Сложные команды переданы модели")
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование разбора шаблонных команд")
+    print("=" * 50)
+    test_simple_commands()
+    test_complex_commands()
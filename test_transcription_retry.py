@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Тест повторных попыток транскрибации: локальный сервер отвечает 503, затем 200
+(проверяются тело запроса из памяти и из файла)
+"""
+import asyncio
+import os
+import tempfile
+
+# Для импорта конфигурации достаточно фиктивных значений - запросы идут на локальный сервер
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from aiohttp import web
+from transcription import TranscriptionService
+
+AUDIO_DATA = b"OggS" + os.urandom(64 * 1024)
+
+
+async def start_server():
+    """Сервер, который отвечает 503 на каждый нечетный запрос и 200 на четный"""
+    requests = []
+
+    async def handler(request: web.Request) -> web.Response:
+        form = await request.post()
+        requests.append(form["file"].file.read())
+        if len(requests) % 2 == 1:
+            return web.Response(status=503, text="temporarily unavailable", headers={"Retry-After": "0"})
+        return web.json_response({"text": "тест"})
+
+    app = web.Application()
+    app.router.add_post("/v1/audio/transcriptions", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/v1/audio/transcriptions", requests
+
+
+async def test_retry():
+    """Повтор после 503 должен отправить то же аудио еще раз"""
+    runner, url, requests = await start_server()
+    service = TranscriptionService()
+    service.api_url = url
+
+    try:
+        result = await service.transcribe_voice_bytes(AUDIO_DATA, "voice.ogg")
+        assert result == "тест", result
+        assert requests == [AUDIO_DATA, AUDIO_DATA], "Тело запроса из памяти отправлено не полностью"
+        print("✅ Повтор с телом из памяти")
+
+        requests.clear()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            audio_path = os.path.join(temp_dir, "voice.ogg")
+            with open(audio_path, "wb") as audio_file:
+                audio_file.write(AUDIO_DATA)
+
+            result = await service.transcribe_voice(audio_path)
+        assert result == "тест", result
+        assert requests == [AUDIO_DATA, AUDIO_DATA], "Тело запроса из файла отправлено не полностью"
+        print("✅ Повтор с телом из файла")
+    finally:
+        await service.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    print("🧪 Тестирование повторных попыток транскрибации")
+    print("=" * 50)
+    asyncio.run(test_retry())
@@ -1,14 +1,37 @@
 """Сервис транскрибации голосовых сообщений через OpenAI Whisper API"""
-import aiofiles
 import aiohttp
 import os
 import asyncio
-import json
+import msgspec
+import random
+import time
 from config import Config
+from rate_limiter import RateLimiter
+from typing import BinaryIO, Optional, Union
 import logging
 
 logger = logging.getLogger(__name__)
 
+# MIME типы аудиофайлов по расширению
+_AUDIO_FORMATS = {
+    '.mp3': 'audio/mpeg',
+    '.mp4': 'audio/mp4',
+    '.mpeg': 'audio/mpeg',
+    '.mpga': 'audio/mpeg',
+    '.m4a': 'audio/mp4',
+    '.wav': 'audio/wav',
+    '.webm': 'audio/webm',
+    '.ogg': 'audio/ogg'
+}
+# Расширения, которые принимает OpenAI Whisper API
+_SUPPORTED_EXTENSIONS = frozenset(_AUDIO_FORMATS)
+
+# Временные ошибки OpenAI, после которых имеет смысл повторить запрос
+_RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Сколько секунд всего можно потратить на повторы (пользователь ждет ответа)
+_RETRY_BUDGET_SECONDS = 45
+
+
 class TranscriptionService:
     """Сервис для преобразования голоса в текст через OpenAI Whisper API"""
     
@@ -16,7 +39,37 @@ class TranscriptionService:
         self.api_key = Config.OPENAI_API_KEY
         self.api_url = "https://api.openai.com/v1/audio/transcriptions"
         self.max_size = 25 * 1024 * 1024  # 25 МБ в байтах (лимит OpenAI)
+        # Заголовки запроса одинаковы для всех запросов
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        # Общая HTTP-сессия: соединения с OpenAI переиспользуются между запросами
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Ограничение одновременных запросов к OpenAI
+        self._semaphore = asyncio.Semaphore(Config.OPENAI_MAX_CONCURRENCY)
+        # Ограничение частоты запросов (0 - без ограничения)
+        self._rate_limiter = RateLimiter(Config.OPENAI_MAX_RPS) if Config.OPENAI_MAX_RPS > 0 else None
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получение общей HTTP-сессии (создается при первом запросе)"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=100,
+                    limit_per_host=32,
+                    keepalive_timeout=75,
+                    ttl_dns_cache=300
+                ),
+                # Ограничиваем подключение и ожидание данных, а не весь запрос:
+                # загрузка большого файла на медленном канале может идти дольше минуты
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+            )
+        return self._session
+    
+    async def close(self):
+        """Закрытие HTTP-сессии (вызывается при остановке бота)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
         
     def _get_audio_format(self, filename: str) -> str:
         """
@@ -29,53 +82,80 @@ class TranscriptionService:
             MIME тип файла
         """
         ext = os.path.splitext(filename)[1].lower()
-        format_map = {
-            '.mp3': 'audio/mpeg',
-            '.mp4': 'audio/mp4', 
-            '.mpeg': 'audio/mpeg',
-            '.mpga': 'audio/mpeg',
-            '.m4a': 'audio/mp4',
-            '.wav': 'audio/wav',
-            '.webm': 'audio/webm',
-            '.ogg': 'audio/ogg'
-        }
-        return format_map.get(ext, 'audio/ogg')  # по умолчанию OGG для Telegram
+        return _AUDIO_FORMATS.get(ext, 'audio/ogg')  # по умолчанию OGG для Telegram
     
-    async def _transcribe_audio(self, audio_data: bytes, session: aiohttp.ClientSession, filename: str = "audio.ogg", max_retries: int = 3) -> str:
+    @staticmethod
+    def _retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
         """
-        Транскрибирует аудио через OpenAI Whisper API с повторными попытками при ошибках
+        Задержка перед повторной попыткой: экспоненциальная со случайной добавкой,
+        чтобы одновременные запросы не повторялись в один момент
         
         Args:
-            audio_data: Данные аудиофайла
-            session: Сессия aiohttp
-            max_retries: Максимальное количество повторных попыток
+            attempt: Номер попытки (с нуля)
+            retry_after: Значение заголовка Retry-After (в секундах), если сервер его прислал
+        """
+        if retry_after:
+            try:
+                return min(float(retry_after), 30)
+            except ValueError:
+                pass
+        return min(2 ** attempt + random.uniform(0, 1), 30)
+    
+    def _build_form_data(self, audio: Union[bytes, BinaryIO], filename: str) -> aiohttp.FormData:
+        """
+        Формирование тела запроса к OpenAI Whisper API
+        
+        Args:
+            audio: Данные аудиофайла или открытый файл (передается потоком)
+            filename: Имя файла
             
         Returns:
-            Транскрибированный текст
+            Данные формы multipart/form-data
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
         # OpenAI Whisper API поддерживает форматы: mp3, mp4, mpeg, mpga, m4a, wav, webm
         # Определяем MIME тип автоматически
         content_type = self._get_audio_format(filename)
         
         data = aiohttp.FormData()
-        data.add_field('file', audio_data, 
+        data.add_field('file', audio, 
                       filename=filename, 
                       content_type=content_type)
         data.add_field('model', 'whisper-1')
         data.add_field('language', 'ru')  # Указываем русский язык для лучшей точности
         data.add_field('response_format', 'json')
+        return data
+    
+    async def _transcribe_audio(self, audio: Union[bytes, str], session: aiohttp.ClientSession, filename: str = "audio.ogg", max_retries: int = 3) -> str:
+        """
+        Транскрибирует аудио через OpenAI Whisper API с повторными попытками при ошибках
         
+        Args:
+            audio: Данные аудиофайла или путь к файлу (передается потоком)
+            session: Сессия aiohttp
+            max_retries: Максимальное количество повторных попыток
+            
+        Returns:
+            Транскрибированный текст
+        """
         last_error = None
+        retry_deadline = time.monotonic() + _RETRY_BUDGET_SECONDS
         
         for attempt in range(max_retries):
+            if self._rate_limiter is not None:
+                await self._rate_limiter.acquire()
+            # Тело запроса собирается заново для каждой попытки: уже отправленную форму
+            # повторно использовать нельзя, а файл aiohttp закрывает после отправки,
+            # поэтому он открывается заново
+            if isinstance(audio, bytes):
+                body = audio
+            else:
+                body = await asyncio.to_thread(open, audio, "rb")
+            data = self._build_form_data(body, filename)
             try:
-                async with session.post(
+                # Ограничиваем число одновременных запросов, чтобы не упираться в лимит OpenAI
+                async with self._semaphore, session.post(
                     self.api_url,
-                    headers=headers,
+                    headers=self._headers,
                     data=data
                 ) as response:
                     if response.status != 200:
@@ -88,58 +168,76 @@ class TranscriptionService:
                             elif "file_too_large" in error_text:
                                 raise Exception("Файл слишком большой. Максимум: 25 МБ")
                         
-                        # При ошибках сервера делаем повторную попытку
-                        if response.status >= 500 and attempt < max_retries - 1:
-                            wait_time = (attempt + 1) * 2  # Экспоненциальная задержка
+                        # Повторяем только временные ошибки (сервер и превышение лимита запросов);
+                        # остальные 4xx (неверный файл, ключ) повтором не исправить - сразу ошибка
+                        wait_time = self._retry_delay(attempt, response.headers.get("Retry-After"))
+                        if (
+                            response.status in _RETRYABLE_STATUSES
+                            and attempt < max_retries - 1
+                            and time.monotonic() + wait_time < retry_deadline
+                        ):
                             logger.warning(
-                                f"Ошибка сервера OpenAI (попытка {attempt + 1}/{max_retries}): "
-                                f"{response.status} - {error_text}. Повтор через {wait_time} сек..."
+                                f"Временная ошибка OpenAI (попытка {attempt + 1}/{max_retries}): "
+                                f"{response.status} - {error_text}. Повтор через {wait_time:.1f} сек..."
                             )
-                            await asyncio.sleep(wait_time)
                             last_error = Exception(f"Ошибка OpenAI API: {response.status}")
-                            continue
+                        else:
+                            logger.error(f"Ошибка API OpenAI: {response.status} - {error_text}")
+                            raise Exception(f"Ошибка распознавания речи: {error_text}")
+                    else:
+                        result = await response.json(loads=msgspec.json.decode)
                         
-                        logger.error(f"Ошибка API OpenAI: {response.status} - {error_text}")
-                        raise Exception(f"Ошибка распознавания речи: {error_text}")
-                    
-                    result = await response.json()
-                    
-                    if "text" not in result:
-                        error_msg = result.get("error", "Неизвестная ошибка")
-                        logger.error(f"Ошибка в ответе OpenAI: {error_msg}")
-                        raise Exception(f"Ошибка распознавания речи: {error_msg}")
-                    
-                    text = result["text"]
-                    return text.strip() if text else ""
+                        if "text" not in result:
+                            error_msg = result.get("error", "Неизвестная ошибка")
+                            logger.error(f"Ошибка в ответе OpenAI: {error_msg}")
+                            raise Exception(f"Ошибка распознавания речи: {error_msg}")
+                        
+                        text = result["text"]
+                        return text.strip() if text else ""
+                
+                # Ждем перед повтором уже после освобождения соединения и места в очереди запросов
+                await asyncio.sleep(wait_time)
                     
             except Exception as e:
-                # Если это не ошибка сервера или последняя попытка, пробрасываем исключение
-                if attempt == max_retries - 1 or not isinstance(e, aiohttp.ClientError):
+                # Если это не ошибка сервера, последняя попытка или время на повторы вышло, пробрасываем исключение
+                wait_time = self._retry_delay(attempt)
+                if (
+                    attempt == max_retries - 1
+                    or not isinstance(e, aiohttp.ClientError)
+                    or time.monotonic() + wait_time >= retry_deadline
+                ):
                     raise
                 last_error = e
-                wait_time = (attempt + 1) * 2
-                logger.warning(f"Исключение при транскрибации (попытка {attempt + 1}/{max_retries}): {e}. Повтор через {wait_time} сек...")
+                logger.warning(f"Исключение при транскрибации (попытка {attempt + 1}/{max_retries}): {e}. Повтор через {wait_time:.1f} сек...")
                 await asyncio.sleep(wait_time)
+            finally:
+                if body is not audio:
+                    body.close()
         
         # Если все попытки исчерпаны, пробрасываем последнюю ошибку
         if last_error:
             raise last_error
         raise Exception("Не удалось транскрибировать аудио после всех попыток")
     
-    def _validate_audio_file(self, audio_path: str) -> None:
+    def _validate_audio_file(self, audio_path: str) -> int:
         """
         Валидирует аудиофайл перед отправкой в OpenAI API
         
         Args:
             audio_path: Путь к аудиофайлу
             
+        Returns:
+            Размер файла в байтах
+            
         Raises:
             Exception: Если файл не валидный
         """
-        if not os.path.exists(audio_path):
+        # Один вызов stat вместо отдельных проверок существования и размера
+        try:
+            file_size = os.stat(audio_path).st_size
+        except FileNotFoundError:
             raise Exception(f"Файл не существует: {audio_path}")
         
-        file_size = os.path.getsize(audio_path)
         if file_size == 0:
             raise Exception("Файл пустой")
         
@@ -150,14 +248,14 @@ class TranscriptionService:
         # Проверяем расширение файла
         filename = os.path.basename(audio_path)
         ext = os.path.splitext(filename)[1].lower()
-        supported_formats = {'.mp3', '.mp4', '.mpeg', '.mpga', '.m4a', '.wav', '.webm', '.ogg'}
-        
-        if ext not in supported_formats:
+        if ext not in _SUPPORTED_EXTENSIONS:
             logger.warning(f"Неподдерживаемый формат файла: {ext}. Попытка отправки все равно будет выполнена.")
+        
+        return file_size
     
     async def transcribe_voice(self, audio_path: str) -> str:
         """
-        Транскрибация голосового сообщения через OpenAI Whisper API.
+        Транскрибация голосового сообщения из файла через OpenAI Whisper API.
         OpenAI поддерживает файлы до 25 МБ, поэтому разделение не требуется.
         
         Args:
@@ -170,26 +268,66 @@ class TranscriptionService:
             Exception: Если произошла ошибка при транскрибации
         """
         try:
-            # Валидация файла
-            self._validate_audio_file(audio_path)
+            # Валидация файла (обращения к файловой системе - в отдельном потоке,
+            # чтобы медленный диск не блокировал цикл событий)
+            file_size = await asyncio.to_thread(self._validate_audio_file, audio_path)
+        except Exception as e:
+            logger.error(f"Ошибка транскрибации: {e}")
+            raise
+        
+        # Файл передается в запрос потоком, без чтения целиком в память
+        return await self._transcribe(audio_path, os.path.basename(audio_path), file_size)
+    
+    async def transcribe_voice_bytes(self, audio_data: bytes, filename: str = "audio.ogg") -> str:
+        """
+        Транскрибация голосового сообщения из памяти через OpenAI Whisper API
+        
+        Args:
+            audio_data: Данные аудиофайла
+            filename: Имя файла (используется для определения формата)
+            
+        Returns:
+            Транскрибированный текст
             
-            file_size = os.path.getsize(audio_path)
+        Raises:
+            Exception: Если произошла ошибка при транскрибации
+        """
+        file_size = len(audio_data)
+        try:
+            if file_size == 0:
+                raise Exception("Файл пустой")
             
-            logger.info(f"Начинаем транскрибацию файла: {audio_path} ({file_size / 1024:.1f} КБ)")
+            if file_size > self.max_size:
+                size_mb = file_size / (1024 * 1024)
+                raise Exception(f"Файл слишком большой ({size_mb:.2f} МБ). Максимум: 25 МБ")
+        except Exception as e:
+            logger.error(f"Ошибка транскрибации: {e}")
+            raise
+        
+        return await self._transcribe(audio_data, filename, file_size)
+    
+    async def _transcribe(self, audio: Union[bytes, str], filename: str, file_size: int) -> str:
+        """
+        Отправка проверенного аудио в OpenAI Whisper API
+        
+        Args:
+            audio: Данные аудиофайла или путь к файлу
+            filename: Имя файла (используется для определения формата)
+            file_size: Размер аудио в байтах
             
-            # Читаем аудиофайл
-            async with aiofiles.open(audio_path, "rb") as audio_file:
-                audio_data = await audio_file.read()
+        Returns:
+            Транскрибированный текст
+        """
+        try:
+            logger.info("Начинаем транскрибацию файла: %s (%.1f КБ)", filename, file_size / 1024)
             
             # Отправляем в OpenAI Whisper API
-            async with aiohttp.ClientSession() as session:
-                filename = os.path.basename(audio_path)
-                text = await self._transcribe_audio(audio_data, session, filename)
-                if not text:
-                    raise Exception("Не удалось распознать речь. Попробуйте записать сообщение еще раз.")
-                
-                logger.info(f"✅ Транскрибация завершена: {text[:50]}...")
-                return text
+            text = await self._transcribe_audio(audio, self._get_session(), filename)
+            if not text:
+                raise Exception("Не удалось распознать речь. Попробуйте записать сообщение еще раз.")
+            
+            logger.info("✅ Транскрибация завершена: %.50s...", text)
+            return text
                 
         except aiohttp.ClientError as e:
             logger.error(f"Ошибка сетевого запроса к OpenAI API: {e}")